@@ -20,6 +20,8 @@ except ImportError:
 from app.db.session import Base
 from app.models.user import User
 from app.models.chat_message import ChatMessage
+from app.models.ingestion_job import IngestionJob
+from app.models.user_document import UserDocument
 
 config = context.config
 config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL)
@@ -0,0 +1,30 @@
+"""add_ingestion_job_content_hash
+
+Revision ID: 3f6a0d5c7e21
+Revises: 8b1e4c2a9d17
+Create Date: 2026-10-17 10:04:52.118730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6a0d5c7e21'
+down_revision: Union[str, None] = '8b1e4c2a9d17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('ingestion_jobs', sa.Column('content_hash', sa.String(), nullable=True))
+    op.create_index(op.f('ix_ingestion_jobs_content_hash'), 'ingestion_jobs', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_ingestion_jobs_content_hash'), table_name='ingestion_jobs')
+    op.drop_column('ingestion_jobs', 'content_hash')
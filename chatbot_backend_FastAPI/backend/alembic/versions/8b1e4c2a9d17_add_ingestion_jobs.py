@@ -0,0 +1,41 @@
+"""add_ingestion_jobs
+
+Revision ID: 8b1e4c2a9d17
+Revises: 632fd2d15da3
+Create Date: 2026-10-17 09:12:31.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1e4c2a9d17'
+down_revision: Union[str, None] = '632fd2d15da3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('ingestion_jobs',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('doc_id', sa.String(), nullable=False),
+    sa.Column('filename', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('stage', sa.String(), nullable=True),
+    sa.Column('progress', sa.Float(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_ingestion_jobs_doc_id'), 'ingestion_jobs', ['doc_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_ingestion_jobs_doc_id'), table_name='ingestion_jobs')
+    op.drop_table('ingestion_jobs')
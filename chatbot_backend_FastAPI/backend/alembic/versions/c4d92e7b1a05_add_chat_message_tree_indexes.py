@@ -0,0 +1,39 @@
+"""add_chat_message_tree_indexes
+
+Revision ID: c4d92e7b1a05
+Revises: 3f6a0d5c7e21
+Create Date: 2026-10-17 13:41:08.502377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d92e7b1a05'
+down_revision: Union[str, None] = '3f6a0d5c7e21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps chat_messages writable while the indexes build,
+    # but it cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_chat_messages_user_id_ltree_path', 'chat_messages', ['user_id', 'ltree_path'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_chat_messages_user_id_timestamp', 'chat_messages', ['user_id', 'timestamp'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_chat_messages_ltree_path_gist', 'chat_messages', ['ltree_path'], unique=False, postgresql_using='gist', postgresql_concurrently=True, if_not_exists=True)
+        op.create_index(op.f('ix_chat_messages_parent_id'), 'chat_messages', ['parent_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+    op.execute('ANALYZE chat_messages')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix_chat_messages_parent_id'), table_name='chat_messages', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_chat_messages_ltree_path_gist', table_name='chat_messages', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_chat_messages_user_id_timestamp', table_name='chat_messages', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_chat_messages_user_id_ltree_path', table_name='chat_messages', postgresql_concurrently=True, if_exists=True)
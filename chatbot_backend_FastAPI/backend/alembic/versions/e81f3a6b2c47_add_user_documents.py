@@ -0,0 +1,34 @@
+"""add_user_documents
+
+Revision ID: e81f3a6b2c47
+Revises: c4d92e7b1a05
+Create Date: 2026-10-17 16:21:08.553904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e81f3a6b2c47'
+down_revision: Union[str, None] = 'c4d92e7b1a05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_documents',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('doc_id', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'doc_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_documents')
@@ -1,14 +1,14 @@
 from fastapi import APIRouter
 from sqlalchemy import text
-from app.db.session import engine
+from app.db.session import async_engine
 
 router = APIRouter()
 
 @router.get("/db-check")
-def db_check():
+async def db_check():
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text("SELECT 1"))
+        async with async_engine.connect() as conn:
+            result = await conn.execute(text("SELECT 1"))
             return {"status": "ok", "result": result.scalar()}
     except Exception as e:
         return {"status": "error", "detail": str(e)}
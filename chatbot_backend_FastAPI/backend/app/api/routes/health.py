@@ -0,0 +1,28 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.api.routes.rag_chat import embedding_model
+from app.core.config import settings
+
+router = APIRouter()
+
+@router.get("/health/live")
+def liveness():
+    # The process is up and serving; nothing else is checked here
+    return {"status": "ok"}
+
+@router.get("/health/ready")
+def readiness():
+    # With warm-up enabled, only take traffic once the embedding model is loaded
+    ready = embedding_model.is_warm or not settings.EMBEDDING_WARMUP
+    if ready:
+        status = "ready"
+    else:
+        status = "failed" if embedding_model.state == "failed" else "warming"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": status,
+            "embedding_model": embedding_model.state,
+            "embedding_model_load_seconds": embedding_model.load_seconds,
+        },
+    )
@@ -0,0 +1,110 @@
+from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from app.api.routes.rag_chat import doc_vectorstores, embedding_model, llm_flights, llm_scheduler, response_cache
+from app.api.routes.response import password_hasher, principal_cache
+from app.db.session import engine, async_engine
+from app.services import metrics
+
+router = APIRouter()
+
+def _pool_connections():
+    values = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "idle")] = pool.checkedin()
+        values[(name, "overflow")] = max(pool.overflow(), 0)
+    return values
+
+def _response_cache_events():
+    if not response_cache:
+        return {}
+    return {(kind,): value for kind, value in response_cache.stats().items() if kind != "hit_rate"}
+
+LLM_REJECTIONS = ("rate_limited", "queue_full", "deadline", "timeout")
+
+def _llm_rejections():
+    stats = llm_scheduler.stats()
+    return {(reason,): stats[reason] for reason in LLM_REJECTIONS}
+
+def _principal_lookups():
+    stats = principal_cache.stats()
+    return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+PASSWORD_JOBS = ("hashed", "verified", "rejected")
+
+def _password_jobs():
+    stats = password_hasher.stats()
+    return {(outcome,): stats[outcome] for outcome in PASSWORD_JOBS}
+
+def _llm_coalescing():
+    stats = llm_flights.stats()
+    return {("leader",): stats["leaders"], ("follower",): stats["followers"]}
+
+# Read when /metrics is scraped, so they cost nothing between scrapes
+metrics.registry.register(metrics.Gauge(
+    "db_pool_connections", "Connections per pool and state", ("engine", "state"), collect=_pool_connections,
+))
+metrics.registry.register(metrics.Gauge(
+    "vectorstore_documents", "Indexed documents", collect=doc_vectorstores.document_count,
+))
+metrics.registry.register(metrics.Gauge(
+    "vectorstore_chunks", "Chunks in the library collection", collect=doc_vectorstores.chunk_count,
+))
+metrics.registry.register(metrics.Gauge(
+    "vectorstore_hot_lexical_bytes", "BM25 indexes held in memory, by on-disk size",
+    collect=lambda: doc_vectorstores.stats()["hot_bytes"],
+))
+metrics.registry.register(metrics.Gauge(
+    "embedding_queue_depth", "Embedding requests waiting for the batcher",
+    collect=lambda: embedding_model.stats()["queue_depth"],
+))
+metrics.registry.register(metrics.Counter(
+    "embedding_texts_total", "Texts embedded by the API process",
+    collect=lambda: embedding_model.stats()["texts"],
+))
+metrics.registry.register(metrics.Counter(
+    "response_cache_events_total", "Response cache lookups and stores by outcome", ("event",),
+    collect=_response_cache_events,
+))
+
+metrics.registry.register(metrics.Counter(
+    "auth_principal_lookups_total", "Token users found in the principal cache or looked up in the database",
+    ("result",), collect=_principal_lookups,
+))
+metrics.registry.register(metrics.Gauge(
+    "auth_principal_cache_entries", "Verified principals held in the cache",
+    collect=lambda: principal_cache.stats()["entries"],
+))
+metrics.registry.register(metrics.Gauge(
+    "password_hash_jobs_pending", "bcrypt jobs admitted and not yet finished, running or queued",
+    collect=lambda: password_hasher.stats()["pending"],
+))
+metrics.registry.register(metrics.Counter(
+    "password_hash_jobs_total", "bcrypt jobs by outcome; rejected ones were answered 429", ("outcome",),
+    collect=_password_jobs,
+))
+
+metrics.registry.register(metrics.Gauge(
+    "llm_calls_running", "LLM calls holding an upstream slot",
+    collect=lambda: llm_scheduler.stats()["running"],
+))
+metrics.registry.register(metrics.Gauge(
+    "llm_calls_waiting", "LLM calls queued for a slot",
+    collect=lambda: llm_scheduler.stats()["waiting"],
+))
+metrics.registry.register(metrics.Counter(
+    "llm_calls_rejected_total", "LLM calls turned away by the scheduler, by reason", ("reason",),
+    collect=_llm_rejections,
+))
+metrics.registry.register(metrics.Counter(
+    "llm_calls_coalesced_total", "Uncached LLM answers by whether they made the upstream call or shared one",
+    ("role",), collect=_llm_coalescing,
+))
+
+# 📈 Prometheus scrape endpoint
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Counting documents and chunks touches disk, so render off the event loop
+    text = await run_in_threadpool(metrics.registry.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
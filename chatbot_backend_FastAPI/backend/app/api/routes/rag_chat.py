@@ -1,177 +1,734 @@
-from fastapi import APIRouter, Form, UploadFile, File, Depends
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Form, UploadFile, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.formparsers import MultiPartException, MultiPartParser
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from sqlalchemy.orm import Session
-from sqlalchemy_utils import Ltree
-from app.api.routes.response import get_db, get_current_user
-from app.models.chat_message import ChatMessage
-from app.models.user import User
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.routes.response import get_db, get_current_principal, get_optional_principal, Principal
+from app.models.chat_message import ChatMessage, new_ltree_path
+from app.models.ingestion_job import IngestionJob
+from app.models.user_document import UserDocument
+from app.core.config import settings
+from app.services.vectorstore import PersistentVectorStore
+from app.services.embedding_service import BatchingEmbeddings, load_embeddings
+from app.services import ingestion
+from app.services.llm_client import get_llm_client, LLMError
+from app.services.llm_scheduler import ANONYMOUS_PREFIX, LLMBusy, LLMScheduler, SingleFlight
+from app.services.response_cache import ResponseCache, MemoryBackend, RedisBackend, exact_key
+from app.services.conversation_context import ConversationContextBuilder, estimate_tokens, fetch_ancestor_chain
+from app.services.metrics import stage
+from app.services import metrics
+from app.services.retrieval import hybrid_search
 from datetime import datetime
-import tempfile, os, requests, uuid, re
+from app.db.session import AsyncSessionLocal
+import tempfile, os, uuid, re, json, hashlib
 
 router = APIRouter()
 load_dotenv()
 
-HF_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
-API_URL = "https://router.huggingface.co/novita/v3/openai/chat/completions"
-HEADERS = {"Authorization": f"Bearer {HF_TOKEN}"}
+# 🧠 HuggingFace Embedding model, shared by all requests through one batching thread.
+# Built on first use (or by the startup warm-up), never at import time.
+def load_embedding_model():
+    return load_embeddings(settings.EMBEDDING_MODEL)
 
-# 🧠 HuggingFace Embedding model
-embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+embedding_model = BatchingEmbeddings(
+    load_embedding_model,
+    max_batch_size=settings.EMBED_BATCH_SIZE,
+    max_wait_ms=settings.EMBED_MAX_WAIT_MS,
+)
 
-# 📦 In-memory store (for demo purposes)
-doc_vectorstores = {}
+# 📦 Persistent store: one library collection for every document, filtered by doc_id
+doc_vectorstores = PersistentVectorStore(
+    settings.VECTORSTORE_DIR, settings.VECTORSTORE_CACHE_BYTES, embedding_model, url=settings.LIBRARY_CHROMA_URL
+)
 
-def save_vectorstore(doc_id, vectorstore):
-    doc_vectorstores[doc_id] = vectorstore
+def make_cache_backend():
+    if settings.RESPONSE_CACHE_BACKEND == "redis":
+        return RedisBackend(settings.RESPONSE_CACHE_REDIS_URL)
+    return MemoryBackend(settings.RESPONSE_CACHE_MAX_ENTRIES)
 
+# 🗃️ Cache of LLM answers, checked before every model call
+response_cache = None
+if settings.RESPONSE_CACHE_ENABLED:
+    response_cache = ResponseCache(
+        make_cache_backend(),
+        ttl=settings.RESPONSE_CACHE_TTL,
+        embed=embedding_model.embed_query if settings.RESPONSE_CACHE_SEMANTIC else None,
+        similarity=settings.RESPONSE_CACHE_SIMILARITY,
+    )
+
+# 🚦 Per-user rate limits and a fair queue in front of the LLM, and one
+# upstream call for identical prompts that are in flight at the same time
+llm_scheduler = LLMScheduler(
+    max_concurrency=settings.LLM_CONCURRENCY,
+    max_queue=settings.LLM_QUEUE_MAX,
+    rate=settings.LLM_USER_RATE,
+    burst=settings.LLM_USER_BURST,
+    timeout=settings.LLM_QUEUE_TIMEOUT,
+    anonymous_rate=settings.LLM_ANONYMOUS_RATE,
+    anonymous_burst=settings.LLM_ANONYMOUS_BURST,
+)
+llm_flights = SingleFlight()
+
+def busy_response(e: LLMBusy):
+    if e.reason == "rate_limited":
+        message = "Too many questions, try again shortly"
+    else:
+        message = "The assistant is busy, try again shortly"
+    return JSONResponse(status_code=e.status_code, content={"error": message}, headers=e.headers)
+
+# Both touch disk (an old per-document index is migrated on first use), so
+# call them through run_in_threadpool
 def get_vectorstore(doc_id):
     return doc_vectorstores.get(doc_id)
 
-#  Call Hugging Face-hosted LLM with prompt
-def call_hf_llm(context: str, question: str):
-    prompt = f"""You are a helpful assistant. Use the following context to answer the question:\n\n{context}\n\nQuestion: {question}"""
-    
+def indexed_doc_ids(doc_ids: list[str]) -> list[str]:
+    return [doc_id for doc_id in doc_ids if get_vectorstore(doc_id)]
+
+async def retrieve_context(doc_ids: list[str], question: str, k: int, mmr: bool, score_threshold: float) -> str:
+    """The best chunks across doc_ids, from one filtered query on the library"""
+    with stage("embed_query"):
+        query_embedding = await embedding_model.aembed_query(question)
+    with stage("retrieval"):
+        lexical = None
+        if settings.RETRIEVAL_HYBRID:
+            # BM25 indexes not in memory are read from disk
+            lexical = await run_in_threadpool(doc_vectorstores.get_lexical_many, doc_ids)
+        chunks = await hybrid_search(
+            doc_vectorstores.library,
+            lexical,
+            question,
+            query_embedding,
+            k=k,
+            fetch_k=max(settings.RETRIEVAL_FETCH_K, k),
+            mmr=mmr,
+            mmr_lambda=settings.RETRIEVAL_MMR_LAMBDA,
+            score_threshold=score_threshold,
+            where=doc_vectorstores.search_filter(doc_ids),
+        )
+    return "\n\n".join(chunk["text"] for chunk in chunks)
+
+def split_doc_ids(doc_id: str | None, doc_ids: list[str] | None) -> list[str]:
+    """doc_id plus doc_ids, given as repeated fields or comma-separated, without duplicates"""
+    requested = [doc_id] if doc_id else []
+    for value in doc_ids or []:
+        requested.extend(part.strip() for part in value.split(",") if part.strip())
+    return list(dict.fromkeys(requested))
+
+async def library_doc_ids(db: AsyncSession, user_id) -> list[str]:
+    return list(await db.scalars(
+        select(UserDocument.doc_id).where(UserDocument.user_id == user_id).order_by(UserDocument.created_at)
+    ))
+
+async def add_to_library(db: AsyncSession, user_id, doc_id: str):
+    await db.execute(pg_insert(UserDocument).values(user_id=user_id, doc_id=doc_id).on_conflict_do_nothing())
+
+async def settle_stale_job(db: AsyncSession, job: IngestionJob) -> IngestionJob:
+    """Record a job that was lost to a crash or restart as failed"""
+    if ingestion.is_stale(job):
+        job.status = "failed"
+        job.error = "Interrupted before it finished; upload the file again"
+        await db.commit()
+    return job
+
+async def missing_doc_response(db: AsyncSession, doc_id: str, message: str):
+    # A document that is still being ingested is not "not found"
+    job = await db.scalar(
+        select(IngestionJob)
+        .where(IngestionJob.doc_id == doc_id)
+        .order_by(IngestionJob.created_at.desc())
+        .limit(1)
+    )
+    if job and (await settle_stale_job(db, job)).status in ingestion.UNFINISHED:
+        return JSONResponse(status_code=409, content={
+            "error": "Document is still being processed",
+            "job_id": str(job.id),
+            "stage": job.stage,
+            "progress": job.progress,
+        })
+    return JSONResponse(status_code=404, content={"error": message})
+
+LLM_MODEL = "deepseek/deepseek-v3-0324"
+
+def build_llm_payload(context: str, question: str, stream: bool = False, history: str = "") -> dict:
+    if history:
+        prompt = f"""You are a helpful assistant. Use the following context and conversation to answer the question:\n\n{context}\n\nConversation so far:\n{history}\n\nQuestion: {question}"""
+    else:
+        prompt = f"""You are a helpful assistant. Use the following context to answer the question:\n\n{context}\n\nQuestion: {question}"""
     payload = {
-        "model": "deepseek/deepseek-v3-0324",
+        "model": LLM_MODEL,
         "messages": [{"role": "user", "content": prompt}]
     }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def cache_context(context: str, history: str) -> str:
+    # The answer depends on the branch too, so the history is part of the key
+    return f"{history}\n\n{context}" if history else context
+
+def count_llm_tokens(payload: dict, answer: str, usage: dict | None = None):
+    # The API's usage figures when it sends them, else the history budget's estimate
+    usage = usage or {}
+    prompt = payload["messages"][-1]["content"]
+    metrics.llm_tokens.inc(usage.get("prompt_tokens") or estimate_tokens(prompt), direction="in")
+    metrics.llm_tokens.inc(usage.get("completion_tokens") or estimate_tokens(answer), direction="out")
+
+# 🌳 Summaries of older turns for the conversation context, queued and
+# rate-limited like the questions of the user they are made for
+async def summarize_branch(text: str, user: str) -> str:
+    payload = {
+        "model": LLM_MODEL,
+        "messages": [{"role": "user", "content": f"Summarize this conversation in at most five sentences. Keep names, numbers and conclusions.\n\n{text}"}],
+    }
+    llm_scheduler.admit(user)
+    async with llm_scheduler.slot(user):
+        data = await get_llm_client().complete(payload)
+    summary = data["choices"][0]["message"]["content"].strip()
+    count_llm_tokens(payload, summary, data.get("usage"))
+    return summary
+
+conversation_context = None
+if settings.CONVERSATION_CONTEXT_ENABLED:
+    conversation_context = ConversationContextBuilder(
+        make_cache_backend(),
+        summarize_branch,
+        token_budget=settings.CONVERSATION_TOKEN_BUDGET,
+        summary_every=settings.CONVERSATION_SUMMARY_EVERY,
+        summary_ttl=settings.CONVERSATION_SUMMARY_TTL,
+    )
+
+async def cached_answer(context: str, question: str, doc_id: str = None, history: str = ""):
+    if not response_cache:
+        return None
+    return await response_cache.lookup(doc_id, question, cache_context(context, history), semantic=not history)
+
+#  Call Hugging Face-hosted LLM with prompt
+# Raises LLMBusy when the scheduler turns the call away. Only the call that
+# goes upstream is admitted: cache hits and callers sharing an in-flight
+# call cost the user nothing.
+async def call_hf_llm(context: str, question: str, doc_id: str = None, history: str = "", user: str = "anonymous"):
+    cached = await cached_answer(context, question, doc_id, history)
+    if cached is not None:
+        return cached
+
+    payload = build_llm_payload(context, question, history=history)
 
-    response = requests.post(API_URL, headers=HEADERS, json=payload)
-    if response.status_code == 200:
+    async def generate():
+        llm_scheduler.admit(user)
         try:
-            print(response.json()["choices"][0]["message"]["content"])
-            return response.json()["choices"][0]["message"]["content"]
+            async with llm_scheduler.slot(user):
+                data = await get_llm_client().complete(payload)
+        except LLMError as e:
+            return f"Error: {e}"
+        try:
+            answer = data["choices"][0]["message"]["content"]
         except Exception:
-            return f"Unexpected response format: {response.json()}"
-    else:
-        return f"Error: {response.status_code} - {response.text}"
+            return f"Unexpected response format: {data}"
+        count_llm_tokens(payload, answer, data.get("usage"))
+
+        if response_cache:
+            await response_cache.store(doc_id, question, cache_context(context, history), answer, semantic=not history)
+        return answer
+
+    # A class asking the same thing at once gets one upstream call, keyed like the cache
+    return await llm_flights.do(exact_key(doc_id, question, cache_context(context, history)), generate)
+
+# 🌊 Same call with stream: true; yields content deltas as they arrive.
+# The caller looks up the cache and admits the call first (admit_stream).
+# Raises LLMError or LLMBusy, possibly after some deltas.
+async def stream_hf_llm(context: str, question: str, doc_id: str = None, history: str = "", user: str = "anonymous", cached: str = None):
+    if cached is not None:
+        yield cached
+        return
+
+    payload = build_llm_payload(context, question, stream=True, history=history)
+
+    parts = []
+    async with llm_scheduler.slot(user):
+        async for line in get_llm_client().stream_lines(payload):
+            # OpenAI-compatible SSE: "data: {json}" lines, terminated by "data: [DONE]"
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                delta = json.loads(data)["choices"][0]["delta"].get("content")
+            except (ValueError, KeyError, IndexError):
+                continue
+            if delta:
+                parts.append(delta)
+                yield delta
+    count_llm_tokens(payload, "".join(parts))
+
+    if response_cache and parts:
+        await response_cache.store(doc_id, question, cache_context(context, history), "".join(parts), semantic=not history)
 
 # 🧹 Clean and format LaTeX and markdown for better frontend display
 def clean_llm_output(text: str) -> str:
+    return _clean_text(text).strip()
+
+# LaTeX symbol commands and their Unicode replacements. Order matters where
+# one name is a prefix of another: the first listed wins, so \subseteq
+# becomes "⊂eq", as it always has.
+LATEX_SYMBOLS = {
+    "times": "×",
+    "div": "÷",
+    "pm": "±",
+    "mp": "∓",
+    "leq": "≤",
+    "geq": "≥",
+    "neq": "≠",
+    "approx": "≈",
+    "infty": "∞",
+    "sum": "Σ",
+    "prod": "Π",
+    "int": "∫",
+    "partial": "∂",
+    "alpha": "α",
+    "beta": "β",
+    "gamma": "γ",
+    "Delta": "Δ",
+    "rightarrow": "→",
+    "leftarrow": "←",
+    "Rightarrow": "⇒",
+    "Leftarrow": "⇐",
+    "leftrightarrow": "↔",
+    "Leftrightarrow": "⇔",
+    "forall": "∀",
+    "exists": "∃",
+    "in": "∈",
+    "notin": "∉",
+    "subset": "⊂",
+    "subseteq": "⊆",
+    "cup": "∪",
+    "cap": "∩",
+    "emptyset": "∅",
+    "nabla": "∇",
+    "cdot": "·",
+    "sqrt": "√",
+}
+
+# Compiled once. Each pass still sees the output of the one before it (a
+# \text{} around a \frac{} only unwraps after the fraction is rewritten),
+# so the passes cannot be merged into one without changing the output. What
+# can be merged is the symbol table: every name starts at a backslash and
+# replacements never contain one, so one alternation in table order matches
+# exactly what one pass per symbol would.
+_BLOCK_BRACKETS = re.compile(r"\\\[(.*?)\\\]", re.DOTALL)
+_BLOCK_DOLLARS = re.compile(r"\$\$(.*?)\$\$", re.DOTALL)
+_INLINE_PARENS = re.compile(r"\\\((.*?)\\\)")
+_INLINE_DOLLARS = re.compile(r"\$(.*?)\$")
+_SYMBOLS = re.compile(r"\\(" + "|".join(LATEX_SYMBOLS) + ")")
+_FRAC = re.compile(r"\\frac{(.*?)}{(.*?)}")
+_VEC = re.compile(r"\\vec{(.*?)}")
+_TEXT = re.compile(r"\\text\{(.*?)\}")
+_MATHRM = re.compile(r"\\mathrm\{(.*?)\}")
+_NEWLINES = re.compile(r"\n{3,}")
+_BOLD_STARS = re.compile(r"\*\*([^*]+)\*\*")
+_ITALIC_STAR = re.compile(r"\*([^*]+)\*")
+_BOLD_UNDERSCORES = re.compile(r"__([^_]+)__")
+_ITALIC_UNDERSCORE = re.compile(r"_([^_]+)_")
+_HEADING = re.compile(r"^#+\s*", re.MULTILINE)
+_ESCAPE = re.compile(r"\\([^a-zA-Z])")
+
+def _clean_text(text: str) -> str:
+    # Every pass is skipped when the text lacks a character it needs, which
+    # is checked on the current text so earlier passes are accounted for.
+
     # First handle the block equations
-    text = re.sub(r"\\\[(.*?)\\\]", 
-                 lambda match: f"\nEquation:\n{match.group(1)}\n", 
-                 text, flags=re.DOTALL)
-    
-    text = re.sub(r"\$\$(.*?)\$\$", 
-                 lambda match: f"\nEquation:\n{match.group(1)}\n", 
-                 text, flags=re.DOTALL)
-    
+    if "\\[" in text:
+        text = _BLOCK_BRACKETS.sub(r"\nEquation:\n\1\n", text)
+    if "$$" in text:
+        text = _BLOCK_DOLLARS.sub(r"\nEquation:\n\1\n", text)
+
     # Then handle inline equations
-    text = re.sub(r"\\\((.*?)\\\)", 
-                 lambda match: f"({match.group(1)})", 
-                 text)
-    
-    text = re.sub(r"\$(.*?)\$", 
-                 lambda match: f"({match.group(1)})", 
-                 text)
-    
-    # Define LaTeX symbol replacements with proper escaping
-    latex_symbols = [
-        (r"\\times", "×"),
-        (r"\\div", "÷"),
-        (r"\\pm", "±"),
-        (r"\\mp", "∓"),
-        (r"\\leq", "≤"),
-        (r"\\geq", "≥"),
-        (r"\\neq", "≠"),
-        (r"\\approx", "≈"),
-        (r"\\infty", "∞"),
-        (r"\\sum", "Σ"),
-        (r"\\prod", "Π"),
-        (r"\\int", "∫"),
-        (r"\\partial", "∂"),
-        (r"\\alpha", "α"),
-        (r"\\beta", "β"),
-        (r"\\gamma", "γ"),
-        (r"\\Delta", "Δ"),
-        (r"\\rightarrow", "→"),
-        (r"\\leftarrow", "←"),
-        (r"\\Rightarrow", "⇒"),
-        (r"\\Leftarrow", "⇐"),
-        (r"\\leftrightarrow", "↔"),
-        (r"\\Leftrightarrow", "⇔"),
-        (r"\\forall", "∀"),
-        (r"\\exists", "∃"),
-        (r"\\in", "∈"),
-        (r"\\notin", "∉"),
-        (r"\\subset", "⊂"),
-        (r"\\subseteq", "⊆"),
-        (r"\\cup", "∪"),
-        (r"\\cap", "∩"),
-        (r"\\emptyset", "∅"),
-        (r"\\nabla", "∇"),
-        (r"\\cdot", "·"),
-        (r"\\sqrt", "√"),
-        (r"\\frac{(.*?)}{(.*?)}", r"\1/\2"),  # Handle fractions
-        (r"\\vec{(.*?)}", r"vector \1"),
-    ]
-    
-    for pattern, replacement in latex_symbols:
-        text = re.sub(pattern, replacement, text)
-    
-    # Handle text formatting commands
-    text = re.sub(r"\\text\{(.*?)\}", r"\1", text)
-    text = re.sub(r"\\mathrm\{(.*?)\}", r"\1", text)
-    
+    if "\\(" in text:
+        text = _INLINE_PARENS.sub(r"(\1)", text)
+    if "$" in text:
+        text = _INLINE_DOLLARS.sub(r"(\1)", text)
+
+    if "\\" in text:
+        text = _SYMBOLS.sub(lambda match: LATEX_SYMBOLS[match.group(1)], text)
+        if "\\frac{" in text:
+            text = _FRAC.sub(r"\1/\2", text)  # Handle fractions
+        if "\\vec{" in text:
+            text = _VEC.sub(r"vector \1", text)
+
+        # Handle text formatting commands
+        if "\\text{" in text:
+            text = _TEXT.sub(r"\1", text)
+        if "\\mathrm{" in text:
+            text = _MATHRM.sub(r"\1", text)
+
     # Remove excessive newlines
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    
+    if "\n\n\n" in text:
+        text = _NEWLINES.sub("\n\n", text)
+
     # Remove markdown formatting
-    text = re.sub(r"\*\*([^*]+)\*\*", r"\1", text)
-    text = re.sub(r"\*([^*]+)\*", r"\1", text)
-    text = re.sub(r"__([^_]+)__", r"\1", text)
-    text = re.sub(r"_([^_]+)_", r"\1", text)
-    text = re.sub(r"^#+\s*", "", text, flags=re.MULTILINE)
-    
+    if "*" in text:
+        if "**" in text:
+            text = _BOLD_STARS.sub(r"\1", text)
+        text = _ITALIC_STAR.sub(r"\1", text)
+    if "_" in text:
+        if "__" in text:
+            text = _BOLD_UNDERSCORES.sub(r"\1", text)
+        text = _ITALIC_UNDERSCORE.sub(r"\1", text)
+    if "#" in text:
+        text = _HEADING.sub("", text)
+
     # Clean up remaining backslashes
-    text = re.sub(r"\\([^a-zA-Z])", r"\1", text)
-    
-    return text.strip()
+    if "\\" in text:
+        text = _ESCAPE.sub(r"\1", text)
 
-# 📥 Upload and vectorize a PDF
-@router.post("/rag/upload-doc")
-async def upload_doc(file: UploadFile = File(...)):
-    # Save file temporarily
+    return text
+
+class StreamingCleaner:
+    """
+    Incremental cleaning for streamed answers.
+
+    Text is cut at the last paragraph break seen so far and everything
+    before the cut is cleaned on its own, so an unpaired `*`, `_` or `$`
+    only affects its own paragraphs and each delta is scanned once. A cut
+    waits while a block equation is open, up to MAX_PENDING characters.
+    The joined fragments can differ from clean_llm_output(full_text) where
+    markup spans paragraphs; the `done` event carries the exact answer.
+    """
+
+    # Held back at most this long waiting for a block equation to close
+    MAX_PENDING = 8192
+
+    def __init__(self):
+        self._pending = ""
+        self._scanned = 0
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        self._pending += chunk
+        # Only the new text is searched; a break can straddle two deltas
+        cut = self._pending.rfind("\n\n", max(0, self._scanned - 1))
+        self._scanned = len(self._pending)
+        if cut <= 0:
+            return ""
+        head = self._pending[:cut]
+        if self._open_equation(head) and len(self._pending) < self.MAX_PENDING:
+            return ""
+        self._pending = self._pending[cut:]
+        self._scanned = len(self._pending)
+        return self._emit(head)
+
+    def finish(self) -> str:
+        tail = self._emit(self._pending)
+        self._pending = ""
+        return tail
+
+    def _emit(self, text: str) -> str:
+        cleaned = _clean_text(text).strip()
+        if not cleaned:
+            return ""
+        if not self._started:
+            self._started = True
+            return cleaned
+        return "\n\n" + cleaned
+
+    @staticmethod
+    def _open_equation(text: str) -> bool:
+        return text.count("$$") % 2 == 1 or text.count("\\[") > text.count("\\]")
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def serialize_message(msg: ChatMessage) -> dict:
+    return {
+        "id": str(msg.id),
+        "content": msg.content,
+        "parent_id": str(msg.parent_id) if msg.parent_id else None,
+        "ltree_path": msg.ltree_path_str,
+        "is_user": msg.is_user,
+        "timestamp": msg.timestamp.isoformat(),
+        "doc_id": msg.doc_id,
+    }
+
+async def admit_stream(context: str, question: str, doc_id: str = None, history: str = "", user: str = "anonymous"):
+    """
+    The cached answer for a streamed question, or None once the upstream
+    call is admitted. Done before the response starts, so LLMBusy can
+    still be answered with its status code.
+    """
+    cached = await cached_answer(context, question, doc_id, history)
+    if cached is None:
+        llm_scheduler.admit(user)
+    return cached
+
+async def stream_answer(context: str, question: str, doc_id: str = None, on_complete=None, first_event=None, history: str = "", user: str = "anonymous", cached: str = None):
+    """
+    Server-sent events for a streamed answer: an optional first event, one
+    `token` event per cleaned fragment, then `done` with the full cleaned
+    answer (or whatever on_complete returns for it). If the LLM fails or
+    the queue turns the call away, the stream ends with an `error` event
+    instead and on_complete is not called.
+    """
+    if first_event:
+        yield sse_event(*first_event)
+    cleaner = StreamingCleaner()
+    raw = []
+    # Includes the time the client takes to read each event
+    with stage("llm_stream"):
+        try:
+            async for delta in stream_hf_llm(context, question, doc_id, history, user, cached):
+                raw.append(delta)
+                text = cleaner.feed(delta)
+                if text:
+                    yield sse_event("token", {"text": text})
+        except (LLMError, LLMBusy) as e:
+            # A partial answer is not a reply: nothing is saved or cached
+            message = "The assistant is busy, try again shortly" if isinstance(e, LLMBusy) else f"Error: {e}"
+            yield sse_event("error", {"error": message})
+            return
+    text = cleaner.finish()
+    if text:
+        yield sse_event("token", {"text": text})
+    with stage("clean"):
+        answer = clean_llm_output("".join(raw))
+    result = await on_complete(answer) if on_complete else {"answer": answer}
+    yield sse_event("done", result)
+
+async def find_document_by_hash(db: AsyncSession, content_hash: str):
+    jobs = await db.scalars(
+        select(IngestionJob)
+        .where(IngestionJob.content_hash == content_hash, IngestionJob.status != "failed")
+        .order_by(IngestionJob.created_at.desc())
+    )
+    for job in jobs.all():
+        # A finished job only counts if its index is still on disk, an
+        # unfinished one only if some process is still working on it
+        if job.status == "done" and doc_vectorstores.exists(job.doc_id):
+            return job
+        if job.status in ingestion.UNFINISHED and (await settle_stale_job(db, job)).status != "failed":
+            return job
+    return None
+
+async def save_upload(file: UploadFile) -> tuple[str | None, str]:
+    """
+    Stream an upload into a temporary file, hashing it on the way. Returns
+    (path, sha256), or (None, "") once it passes UPLOAD_MAX_BYTES. The
+    ingestion worker removes the file when it is done.
+    """
+    hasher = hashlib.sha256()
+    size = 0
     with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        content = await file.read()
-        tmp.write(content)
-        tmp_path = tmp.name
+        while chunk := await file.read(settings.UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if size > settings.UPLOAD_MAX_BYTES:
+                break
+            hasher.update(chunk)
+            await run_in_threadpool(tmp.write, chunk)
+    if size > settings.UPLOAD_MAX_BYTES:
+        os.remove(tmp.name)
+        return None, ""
+    return tmp.name, hasher.hexdigest()
 
+# Room for the multipart boundary and part headers around the file
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+class UploadTooLarge(Exception):
+    pass
+
+async def read_upload_form(request: Request):
+    """
+    Parse a multipart upload, raising UploadTooLarge as soon as the body
+    is bigger than UPLOAD_MAX_BYTES allows: up front from Content-Length,
+    or while reading one sent without it. Nothing past the cap is received
+    or spooled to disk.
+    """
+    limit = settings.UPLOAD_MAX_BYTES + UPLOAD_OVERHEAD_BYTES
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > limit:
+        raise UploadTooLarge()
+
+    async def body():
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > limit:
+                raise UploadTooLarge()
+            yield chunk
+
+    return await MultiPartParser(request.headers, body()).parse()
+
+def upload_too_large_response():
+    return JSONResponse(status_code=413, content={
+        "error": f"File is larger than {settings.UPLOAD_MAX_BYTES // (1024 * 1024)} MB"
+    })
+
+# 📥 Upload a PDF (multipart field "file"); parsing and embedding run in the
+# background. Signed-in uploads are also added to the user's library.
+# The form is read here rather than declared as File(...), which would
+# spool the whole body to disk before the size cap could be checked.
+@router.post("/rag/upload-doc")
+async def upload_doc(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    user: Principal | None = Depends(get_optional_principal),
+):
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        return JSONResponse(status_code=400, content={"error": "Upload the PDF as multipart/form-data"})
     try:
-        loader = PyPDFLoader(tmp_path)
-        documents = loader.load()
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        chunks = splitter.split_documents(documents)
-        vectorstore = Chroma.from_documents(chunks, embedding=embedding_model)
-        doc_id = str(uuid.uuid4())
-        save_vectorstore(doc_id, vectorstore)
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        with stage("upload_receive"):
+            form = await read_upload_form(request)
+    except UploadTooLarge:
+        return upload_too_large_response()
+    except MultiPartException as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    try:
+        file = form.get("file")
+        if file is None or isinstance(file, str):
+            return JSONResponse(status_code=400, content={"error": "No file in the \"file\" field"})
+        # Copied to disk in chunks, so the whole file is never in memory
+        with stage("upload_save"):
+            tmp_path, content_hash = await save_upload(file)
     finally:
+        await form.close()
+    if not tmp_path:
+        return upload_too_large_response()
+
+    # Identical file uploaded before: hand back its index instead of re-embedding
+    existing = await find_document_by_hash(db, content_hash)
+    if existing:
+        os.remove(tmp_path)
+        if user:
+            await add_to_library(db, user.id, existing.doc_id)
+            await db.commit()
+        return JSONResponse(
+            status_code=200 if existing.status == "done" else 202,
+            content={"doc_id": existing.doc_id, "job_id": str(existing.id), "deduplicated": True},
+        )
+
+    doc_id = str(uuid.uuid4())
+    job = IngestionJob(doc_id=doc_id, filename=file.filename, content_hash=content_hash, status="queued")
+    db.add(job)
+    if user:
+        db.add(UserDocument(user_id=user.id, doc_id=doc_id))
+    await db.commit()
+    await db.refresh(job)
+
+    try:
+        ingestion.submit(str(job.id), doc_id, tmp_path, doc_vectorstores)
+    except Exception as e:
         os.remove(tmp_path)
+        job.status = "failed"
+        job.error = str(e)
+        await db.commit()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    return JSONResponse(status_code=202, content={"doc_id": doc_id, "job_id": str(job.id)})
+
+# 📊 Poll the progress of an upload
+@router.get("/rag/jobs/{job_id}")
+async def get_ingestion_job(job_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
+    job = await db.scalar(select(IngestionJob).where(IngestionJob.id == job_id))
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    await settle_stale_job(db, job)
+    return {
+        "job_id": str(job.id),
+        "doc_id": job.doc_id,
+        "filename": job.filename,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+    }
+
+# 📚 The signed-in user's library: documents /rag/chat can search with library=true
+@router.get("/rag/library")
+async def get_library(db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    rows = (await db.execute(
+        select(UserDocument.doc_id, UserDocument.created_at, IngestionJob.filename, IngestionJob.status)
+        .outerjoin(IngestionJob, IngestionJob.doc_id == UserDocument.doc_id)
+        .where(UserDocument.user_id == user.id)
+        .order_by(UserDocument.created_at, IngestionJob.created_at)
+    )).all()
+    # A document can have more than one job; the latest one wins
+    documents = {
+        row.doc_id: {
+            "doc_id": row.doc_id,
+            "filename": row.filename,
+            "status": row.status,
+            "added_at": row.created_at.isoformat(),
+        }
+        for row in rows
+    }
+    return {"documents": list(documents.values())}
 
-    return JSONResponse(content={"doc_id": doc_id})
+@router.post("/rag/library/{doc_id}")
+async def add_library_document(doc_id: str, db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    if not doc_vectorstores.exists(doc_id):
+        job = await db.scalar(
+            select(IngestionJob.id).where(IngestionJob.doc_id == doc_id, IngestionJob.status != "failed").limit(1)
+        )
+        if not job:
+            return JSONResponse(status_code=404, content={"error": "Document not found"})
+    await add_to_library(db, user.id, doc_id)
+    await db.commit()
+    return {"doc_id": doc_id}
+
+@router.delete("/rag/library/{doc_id}")
+async def remove_library_document(doc_id: str, db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    # Only the library entry goes; the index is shared with other users
+    result = await db.execute(
+        delete(UserDocument).where(UserDocument.user_id == user.id, UserDocument.doc_id == doc_id)
+    )
+    await db.commit()
+    if not result.rowcount:
+        return JSONResponse(status_code=404, content={"error": "Document not in library"})
+    return {"doc_id": doc_id}
 
 #  Ask a question over a previously uploaded doc
 @router.post("/rag/ask-doc")
-async def rag_ask_doc(question: str = Form(...), doc_id: str = Form(...)):
-    vectorstore = get_vectorstore(doc_id)
-    if not vectorstore:
-        return JSONResponse(status_code=404, content={"error": "Document not found. Please upload and chunk the PDF first."})
+async def rag_ask_doc(
+    request: Request,
+    question: str = Form(...),
+    doc_id: str = Form(...),
+    stream: bool = Form(False),
+    k: int = Form(settings.RETRIEVAL_K, ge=1, le=50),
+    mmr: bool = Form(settings.RETRIEVAL_MMR),
+    score_threshold: float = Form(settings.RETRIEVAL_SCORE_THRESHOLD, ge=0.0, le=1.0),
+    db: AsyncSession = Depends(get_db),
+):
+    with stage("doc_lookup"):
+        found = await run_in_threadpool(get_vectorstore, doc_id)
+    if not found:
+        return await missing_doc_response(db, doc_id, "Document not found. Please upload and chunk the PDF first.")
+
+    # Anonymous, so scheduled by address (LLM_ANONYMOUS_RATE)
+    client = f"{ANONYMOUS_PREFIX}{request.client.host if request.client else 'unknown'}"
 
-    retriever = vectorstore.as_retriever()
-    docs = retriever.invoke(question)
-    context = "\n\n".join([doc.page_content for doc in docs])
+    context = await retrieve_context([doc_id], question, k, mmr, score_threshold)
+
+    if stream:
+        try:
+            cached = await admit_stream(context, question, doc_id, user=client)
+        except LLMBusy as e:
+            return busy_response(e)
+        return StreamingResponse(stream_answer(context, question, doc_id, user=client, cached=cached), media_type="text/event-stream", headers=SSE_HEADERS)
 
     # LLM call
-    answer = call_hf_llm(context, question)
-    answer = clean_llm_output(answer)
+    with stage("llm"):
+        try:
+            answer = await call_hf_llm(context, question, doc_id, user=client)
+        except LLMBusy as e:
+            return busy_response(e)
+    with stage("clean"):
+        answer = clean_llm_output(answer)
 
     return JSONResponse(content={"answer": answer})
 
@@ -180,104 +737,152 @@ async def rag_chat(
     question: str = Form(...),
     parent_id: str = Form(None),
     doc_id: str = Form(None),
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    doc_ids: list[str] = Form(None),
+    library: bool = Form(False),
+    stream: bool = Form(False),
+    k: int = Form(settings.RETRIEVAL_K, ge=1, le=50),
+    mmr: bool = Form(settings.RETRIEVAL_MMR),
+    score_threshold: float = Form(settings.RETRIEVAL_SCORE_THRESHOLD, ge=0.0, le=1.0),
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_principal),
 ):
-    # 1. Store user message
+    """
+    One chat turn. Retrieval covers doc_id and doc_ids (repeated or
+    comma-separated), plus the user's whole library with library=true,
+    all in a single filtered search.
+    """
+    # 1. Build the user message in memory; it is written together with the answer.
+    # The parent and its ancestors come back in one query and become the history.
+    parent_path = None
+    history = ""
     if parent_id:
-        parent = db.query(ChatMessage).filter(ChatMessage.id == parent_id, ChatMessage.user_id == user.id).first()
-        if not parent:
+        try:
+            parent_id = uuid.UUID(parent_id)
+        except ValueError:
             return JSONResponse(status_code=404, content={"error": "Parent message not found"})
-        ltree_path = f'{parent.ltree_path_str}.{uuid.uuid4().hex[:8]}'
-    else:
-        ltree_path = uuid.uuid4().hex[:8]
+        with stage("parent_lookup"):
+            chain = await fetch_ancestor_chain(db, user.id, parent_id, settings.CONVERSATION_MAX_MESSAGES if conversation_context else 1)
+        if not chain:
+            return JSONResponse(status_code=404, content={"error": "Parent message not found"})
+        parent_path = chain[-1].ltree_path
+        if conversation_context:
+            with stage("history"):
+                history = await conversation_context.build(chain, str(user.id))
+
+    with stage("doc_lookup"):
+        targets = split_doc_ids(doc_id, doc_ids)
+        found = await run_in_threadpool(indexed_doc_ids, targets)
+        missing = next((target for target in targets if target not in found), None)
+        if library and missing is None:
+            # Library documents still being ingested are left out, not an error
+            others = [target for target in await library_doc_ids(db, user.id) if target not in targets]
+            targets += await run_in_threadpool(indexed_doc_ids, others)
+    if missing:
+        return await missing_doc_response(db, missing, "Document not found")
+    # Several documents are recorded (and cached) as one comma-separated doc_id
+    doc_id = ",".join(targets) or None
+
+    # The lookups are done: end the request session's transaction, so its
+    # connection goes back to the pool instead of idling through retrieval,
+    # the LLM queue and the call itself
+    await db.rollback()
+
     user_msg = ChatMessage(
+        id=uuid.uuid4(),
         user_id=user.id,
         parent_id=parent_id,
-        ltree_path=Ltree(ltree_path),
+        ltree_path=new_ltree_path(parent_path),
         content=question,
         is_user=True,
         doc_id=doc_id,
         timestamp=datetime.utcnow(),
     )
-    db.add(user_msg)
-    db.commit()
-    db.refresh(user_msg)
-
-    # 2. Generate AI response
-    if doc_id:
-        vectorstore = get_vectorstore(doc_id)
-        if not vectorstore:
-            return JSONResponse(status_code=404, content={"error": "Document not found"})
-        retriever = vectorstore.as_retriever()
-        docs = retriever.invoke(question)
-        context = "\n\n".join([doc.page_content for doc in docs])
-        answer = call_hf_llm(context, question)
-    else:
-        answer = call_hf_llm("", question)
-    answer = clean_llm_output(answer)
 
-    # 3. Store AI message as child
-    ai_ltree_path = f'{user_msg.ltree_path_str}.{uuid.uuid4().hex[:8]}'
+    # 2. Generate AI response; an upstream call needs the user to be within
+    # their rate and the queue to have room
+    context = ""
+    if targets:
+        context = await retrieve_context(targets, question, k, mmr, score_threshold)
+
+    if stream:
+        try:
+            cached = await admit_stream(context, question, doc_id, history, str(user.id))
+        except LLMBusy as e:
+            return busy_response(e)
+
+        async def save_ai_message(answer):
+            # The request session is already closed once the stream finishes
+            async with AsyncSessionLocal() as stream_db:
+                _, ai_msg = await store_chat_turn(stream_db, user_msg, answer)
+                return {"ai_message": serialize_message(ai_msg)}
+
+        return StreamingResponse(
+            stream_answer(context, question, doc_id, on_complete=save_ai_message, first_event=("user_message", serialize_message(user_msg)), history=history, user=str(user.id), cached=cached),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+
+    with stage("llm"):
+        try:
+            answer = await call_hf_llm(context, question, doc_id, history, str(user.id))
+        except LLMBusy as e:
+            return busy_response(e)
+    with stage("clean"):
+        answer = clean_llm_output(answer)
+
+    # 3. Store the user message and the AI message under it, on a
+    # connection taken only for the write
+    async with AsyncSessionLocal() as turn_db:
+        user_msg, ai_msg = await store_chat_turn(turn_db, user_msg, answer)
+
+    return JSONResponse(content={
+        "user_message": serialize_message(user_msg),
+        "ai_message": serialize_message(ai_msg),
+    })
+
+CHAT_TURN_FIELDS = ("id", "user_id", "parent_id", "ltree_path", "content", "is_user", "doc_id", "timestamp")
+
+async def store_chat_turn(db: AsyncSession, user_msg: ChatMessage, answer: str) -> tuple[ChatMessage, ChatMessage]:
+    """
+    Insert a user message and the AI answer under it with one INSERT ...
+    RETURNING and commit. Both ltree paths are computed in memory, so the
+    turn costs one statement and the commit.
+    """
     ai_msg = ChatMessage(
-        user_id=user.id,
+        id=uuid.uuid4(),
+        user_id=user_msg.user_id,
         parent_id=user_msg.id,
-        ltree_path=Ltree(ai_ltree_path),
+        ltree_path=new_ltree_path(user_msg.ltree_path),
         content=answer,
         is_user=False,
-        doc_id=doc_id,
+        doc_id=user_msg.doc_id,
         timestamp=datetime.utcnow(),
     )
-    db.add(ai_msg)
-    db.commit()
-    db.refresh(ai_msg)
+    rows = [{field: getattr(msg, field) for field in CHAT_TURN_FIELDS} for msg in (user_msg, ai_msg)]
+    with stage("store"):
+        # render_nulls keeps a root's parent_id=None from splitting the batch in two
+        result = await db.scalars(
+            insert(ChatMessage).returning(ChatMessage, sort_by_parameter_order=True),
+            rows,
+            execution_options={"render_nulls": True},
+        )
+        user_msg, ai_msg = result.all()
+        await db.commit()
+    return user_msg, ai_msg
 
-    return JSONResponse(content={
-        "user_message": {
-            "id": str(user_msg.id),
-            "content": user_msg.content,
-            "parent_id": str(user_msg.parent_id) if user_msg.parent_id else None,
-            "ltree_path": user_msg.ltree_path_str,
-            "is_user": True,
-            "timestamp": user_msg.timestamp.isoformat(),
-            "doc_id": user_msg.doc_id,
-        },
-        "ai_message": {
-            "id": str(ai_msg.id),
-            "content": ai_msg.content,
-            "parent_id": str(ai_msg.parent_id),
-            "ltree_path": ai_msg.ltree_path_str,
-            "is_user": False,
-            "timestamp": ai_msg.timestamp.isoformat(),
-            "doc_id": ai_msg.doc_id,
-        }
-    })
+# 🗃️ Response cache counters
+@router.get("/rag/cache-stats")
+def get_cache_stats():
+    if not response_cache:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
 
-@router.get("/chat/tree")
-def get_chat_tree(
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
-):
-    
-    print("this api hitted")
-    """
-    Returns all chat messages for the current user, with ltree_path as a string.
-    """
-    messages = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.user_id == user.id)
-        .order_by(ChatMessage.timestamp)
-        .all()
-    )
-    return [
-        {
-            "id": str(msg.id),
-            "parent_id": str(msg.parent_id) if msg.parent_id else None,
-            "ltree_path": str(msg.ltree_path),
-            "content": msg.content,
-            "is_user": msg.is_user,
-            "timestamp": msg.timestamp.isoformat(),
-            "doc_id": msg.doc_id,
-        }
-        for msg in messages
-    ]
+# 🚦 LLM scheduler queue and coalescing counters
+@router.get("/rag/llm-stats")
+def get_llm_stats():
+    return {"scheduler": llm_scheduler.stats(), "coalescing": llm_flights.stats()}
+
+# 🧠 Embedding batcher throughput and queue depth
+@router.get("/rag/embedding-stats")
+def get_embedding_stats():
+    return embedding_model.stats()
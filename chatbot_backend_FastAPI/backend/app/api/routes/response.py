@@ -1,32 +1,43 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.db.session import SessionLocal
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.session import AsyncSessionLocal, get_async_db
 from app.models.user import User
-from app.models.chat_message import ChatMessage
+from app.core.config import settings
+from app.services.principal_cache import PrincipalCache
+from app.services.password_hasher import PasswordHasher, PasswordHasherBusy
+from app.services.metrics import stage
+from app.services import chat_archive
+from app.models.chat_message import ChatMessage, new_ltree_path
 from passlib.context import CryptContext
 import jwt
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import datetime, timedelta
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
+from sqlalchemy import and_, case, event, func, insert, literal, or_, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import aliased
+from sqlalchemy_utils import Ltree, LtreeType
+import asyncpg
+import base64
+import json
 import uuid
 
 SECRET_KEY = "supersecretkey"  # Use env var in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with a different cost are upgraded on the next successful login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+password_hasher = PasswordHasher(pwd_context, settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_PENDING)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
+# Same scheme for endpoints that also serve anonymous clients
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token", auto_error=False)
 
 router = APIRouter()
 
 # Dependency
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+get_db = get_async_db
 
 # User schemas
 class UserCreate(BaseModel):
@@ -51,25 +62,67 @@ def verify_password(plain, hashed):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def run_password_job(job):
+    # bcrypt runs on its own bounded pool; a full pool means 429, not a queue
+    try:
+        with stage("password_hash"):
+            return await job
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many sign-in attempts in progress, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+class Principal(BaseModel):
+    """The authenticated user without the ORM object; enough for most endpoints"""
+    id: uuid.UUID
+    username: str
+
+principal_cache = PrincipalCache(settings.AUTH_CACHE_TTL, settings.AUTH_CACHE_MAX_ENTRIES)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _forget_principal(mapper, connection, target):
+    principal_cache.invalidate(target.id)
+
+def decode_user_id(token: str) -> uuid.UUID:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid credentials")
-        user = db.query(User).filter(User.id == user_id).first()
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except jwt.PyJWTError:
+        return uuid.UUID(user_id)
+    except (jwt.PyJWTError, ValueError):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> Principal:
+    # Signature and expiry are checked on every request; only the users lookup is cached
+    user_id = decode_user_id(token)
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        with stage("user_lookup"):
+            row = (await db.execute(select(User.id, User.username).where(User.id == user_id))).one_or_none()
+        if row is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        principal = Principal(id=row.id, username=row.username)
+        principal_cache.set(user_id, principal)
+    return principal
+
+async def get_optional_principal(
+    token: str | None = Depends(optional_oauth2_scheme), db: AsyncSession = Depends(get_db)
+) -> Principal | None:
+    """None without a token; a token that is sent must still be valid"""
+    if not token:
+        return None
+    return await get_current_principal(token, db)
+
 @router.get("/")
 async def default_response():
     return {"message": "This is a default response from the backend."}
@@ -82,21 +135,28 @@ async def chapter_summary():
 
 # Register endpoint
 @router.post("/auth/register", response_model=UserOut)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == user.username).first():
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    if await db.scalar(select(User).where(User.username == user.username)):
         raise HTTPException(status_code=400, detail="Username already registered")
-    db_user = User(username=user.username, password_hash=get_password_hash(user.password))
+    password_hash = await run_password_job(password_hasher.hash(user.password))
+    db_user = User(username=user.username, password_hash=password_hash)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 # Login endpoint
 @router.post("/auth/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.username == form_data.username))
+    if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
+    valid, new_hash = await run_password_job(password_hasher.verify_and_update(form_data.password, user.password_hash))
+    if not valid:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
     access_token = create_access_token(data={"sub": str(user.id)})
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -119,48 +179,404 @@ class ChatMessageOut(BaseModel):
     class Config:
         orm_mode = True
 
+    @field_validator("ltree_path", mode="before")
+    @classmethod
+    def ltree_to_str(cls, value):
+        # The ORM hands back sqlalchemy_utils Ltree objects
+        return str(value) if isinstance(value, Ltree) else value
+
 # --- Chat Message Endpoints ---
-from sqlalchemy import select
 
 @router.post("/chat/message", response_model=ChatMessageOut)
-def create_message(
+async def create_message(
     msg: ChatMessageCreate,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_principal),
 ):
-    # Compute ltree_path
+    # Compute ltree_path; only the parent's path is needed, not the row
+    parent_path = None
     if msg.parent_id:
-        parent = db.query(ChatMessage).filter(ChatMessage.id == msg.parent_id, ChatMessage.user_id == user.id).first()
-        if not parent:
+        parent_path = await db.scalar(select(ChatMessage.ltree_path).where(ChatMessage.id == msg.parent_id, ChatMessage.user_id == user.id))
+        if parent_path is None:
             raise HTTPException(status_code=404, detail="Parent message not found")
-        ltree_path = parent.ltree_path + f'.{uuid.uuid4().hex[:8]}'
-    else:
-        ltree_path = uuid.uuid4().hex[:8]
     db_msg = ChatMessage(
+        id=uuid.uuid4(),
         user_id=user.id,
         parent_id=msg.parent_id,
-        ltree_path=ltree_path,
+        ltree_path=new_ltree_path(parent_path),
         content=msg.content,
         is_user=msg.is_user,
         doc_id=msg.doc_id,
+        timestamp=datetime.utcnow(),
     )
+    # Every column is set here and sessions don't expire on commit, so no refresh
     db.add(db_msg)
-    db.commit()
-    db.refresh(db_msg)
+    await db.commit()
     return db_msg
 
+TREE_PAGE_MAX = 1000
+TREE_STREAM_BATCH = 500
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps([str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str, *types):
+    """Inverse of encode_cursor; each value is rebuilt with the matching type"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(type_(value) for type_, value in zip(types, values))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def encode_tree_cursor(msg: ChatMessage) -> str:
+    return encode_cursor(msg.ltree_path, msg.id)
+
+def decode_tree_cursor(cursor: str):
+    return decode_cursor(cursor, Ltree, uuid.UUID)
+
+def tree_query(user_id, after=None, max_depth: int | None = None):
+    """A user's messages in (ltree_path, id) order, resuming after a decoded cursor"""
+    query = (
+        select(ChatMessage)
+        .where(ChatMessage.user_id == user_id)
+    )
+    if max_depth:
+        query = query.where(func.nlevel(ChatMessage.ltree_path) <= max_depth)
+    if after:
+        path, msg_id = after
+        # Keyset condition; the id tie-break keeps pages stable on equal paths
+        query = query.where(or_(
+            ChatMessage.ltree_path > path,
+            and_(ChatMessage.ltree_path == path, ChatMessage.id > msg_id),
+        ))
+    return query.order_by(ChatMessage.ltree_path, ChatMessage.id)
+
+async def stream_tree_ndjson(user_id, after, max_depth, limit):
+    # Own session: the request's session is closed before the body is sent
+    async with AsyncSessionLocal() as db:
+        query = tree_query(user_id, after, max_depth)
+        if limit:
+            query = query.limit(limit + 1)
+        # Server-side cursor, so memory stays flat however long the history is
+        sent = 0
+        last = None
+        rows = await db.stream_scalars(query.execution_options(yield_per=TREE_STREAM_BATCH))
+        async for msg in rows:
+            if limit and sent == limit:
+                yield json.dumps({"next_cursor": encode_tree_cursor(last)}) + "\n"
+                break
+            yield ChatMessageOut.model_validate(msg, from_attributes=True).model_dump_json() + "\n"
+            sent += 1
+            last = msg
+
 @router.get("/chat/tree", response_model=list[ChatMessageOut])
-def get_chat_tree(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    # Return all messages for this user, ordered by ltree_path
-    msgs = db.query(ChatMessage).filter(ChatMessage.user_id == user.id).order_by(ChatMessage.ltree_path).all()
+async def get_chat_tree(
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=TREE_PAGE_MAX),
+    cursor: str | None = None,
+    max_depth: int | None = Query(None, ge=1),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_principal),
+):
+    """
+    The user's messages ordered by ltree_path.
+
+    Without `limit` the whole tree is returned, as before. With `limit`, one
+    page is returned and the cursor for the next page is sent in the
+    X-Next-Cursor header. `max_depth` drops messages deeper than that many
+    levels. `format=ndjson` streams one message per line from a server-side
+    cursor; with `limit`, a final {"next_cursor": ...} line marks more data.
+    """
+    after = decode_tree_cursor(cursor) if cursor else None
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_tree_ndjson(user.id, after, max_depth, limit),
+            media_type="application/x-ndjson",
+        )
+
+    query = tree_query(user.id, after, max_depth)
+    if limit is None:
+        return (await db.scalars(query)).all()
+    msgs = (await db.scalars(query.limit(limit + 1))).all()
+    if len(msgs) > limit:
+        msgs = msgs[:limit]
+        response.headers["X-Next-Cursor"] = encode_tree_cursor(msgs[-1])
     return msgs
 
 @router.get("/chat/subtree/{msg_id}", response_model=list[ChatMessageOut])
-def get_subtree(msg_id: uuid.UUID, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+async def get_subtree(msg_id: uuid.UUID, db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
     # Get the ltree_path for the root message
-    root = db.query(ChatMessage).filter(ChatMessage.id == msg_id, ChatMessage.user_id == user.id).first()
+    root = await db.scalar(select(ChatMessage).where(ChatMessage.id == msg_id, ChatMessage.user_id == user.id))
     if not root:
         raise HTTPException(status_code=404, detail="Message not found")
     # All descendants (including root)
-    msgs = db.query(ChatMessage).filter(ChatMessage.user_id == user.id, ChatMessage.ltree_path.descendant_of(root.ltree_path)).order_by(ChatMessage.ltree_path).all()
-    return msgs
+    msgs = await db.scalars(select(ChatMessage).where(ChatMessage.user_id == user.id, ChatMessage.ltree_path.descendant_of(root.ltree_path)).order_by(ChatMessage.ltree_path))
+    return msgs.all()
+
+# --- Lazy tree expansion ---
+class ChatNodeOut(ChatMessageOut):
+    child_count: int
+    # True when the node has children that were not included in this response
+    has_more: bool
+
+MAX_EXPAND_DEPTH = 10
+
+def child_count_column():
+    # Correlated count of direct children, evaluated per returned row
+    child = aliased(ChatMessage)
+    return (
+        select(func.count())
+        .select_from(child)
+        .where(child.parent_id == ChatMessage.id)
+        .correlate(ChatMessage)
+        .scalar_subquery()
+        .label("child_count")
+    )
+
+def to_node(msg: ChatMessage, child_count: int, expanded: bool) -> ChatNodeOut:
+    node = ChatMessageOut.model_validate(msg, from_attributes=True)
+    return ChatNodeOut(**node.model_dump(), child_count=child_count, has_more=child_count > 0 and not expanded)
+
+@router.get("/chat/roots", response_model=list[ChatNodeOut])
+async def get_root_messages(
+    response: Response,
+    limit: int = Query(50, ge=1, le=TREE_PAGE_MAX),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_principal),
+):
+    """
+    Root messages (one per conversation), newest first, with their child
+    counts. The cursor for the next page is sent in X-Next-Cursor.
+    """
+    query = (
+        select(ChatMessage, child_count_column())
+        .where(ChatMessage.user_id == user.id, ChatMessage.parent_id.is_(None))
+    )
+    if cursor:
+        timestamp, msg_id = decode_cursor(cursor, datetime.fromisoformat, uuid.UUID)
+        query = query.where(or_(
+            ChatMessage.timestamp < timestamp,
+            and_(ChatMessage.timestamp == timestamp, ChatMessage.id < msg_id),
+        ))
+    rows = (await db.execute(query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.timestamp.isoformat(), last.id)
+    return [to_node(msg, count, expanded=False) for msg, count in rows]
+
+@router.get("/chat/children/{msg_id}", response_model=list[ChatNodeOut])
+async def get_children(
+    msg_id: uuid.UUID,
+    depth: int = Query(1, ge=1, le=MAX_EXPAND_DEPTH),
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_principal),
+):
+    """
+    Descendants of a message down to `depth` levels below it, ordered by
+    ltree_path. Nodes on the last level carry has_more when they have
+    children of their own, so the client knows which branches to expand.
+    """
+    node = await db.scalar(select(ChatMessage).where(ChatMessage.id == msg_id, ChatMessage.user_id == user.id))
+    if not node:
+        raise HTTPException(status_code=404, detail="Message not found")
+    node_level = len(str(node.ltree_path).split("."))
+    rows = (await db.execute(
+        select(ChatMessage, child_count_column(), func.nlevel(ChatMessage.ltree_path))
+        .where(
+            ChatMessage.user_id == user.id,
+            ChatMessage.ltree_path.descendant_of(node.ltree_path),
+            func.nlevel(ChatMessage.ltree_path).between(node_level + 1, node_level + depth),
+        )
+        .order_by(ChatMessage.ltree_path)
+    )).all()
+    return [to_node(msg, count, expanded=level < node_level + depth) for msg, count, level in rows]
+
+# --- Subtree copy and move ---
+class SubtreeTarget(BaseModel):
+    # The new parent; null makes the subtree a conversation of its own.
+    # Left out, a copy goes next to the original (a fork of the branch).
+    parent_id: uuid.UUID | None = None
+
+class SubtreeOut(BaseModel):
+    root: ChatMessageOut
+    # Messages copied or moved, the root included
+    count: int
+
+async def load_subtree_target(db: AsyncSession, user_id, msg_id: uuid.UUID, target: SubtreeTarget, keep_parent: bool):
+    """
+    The subtree root, its new parent id and the new parent's path, from one
+    query. With keep_parent, a parent_id left out of the request means the
+    root's current parent.
+    """
+    ids = [msg_id, target.parent_id] if target.parent_id else [msg_id]
+    if keep_parent and "parent_id" not in target.model_fields_set:
+        # The current parent is unknown until the root is loaded, so fetch it alongside
+        ids.append(select(ChatMessage.parent_id).where(ChatMessage.id == msg_id).scalar_subquery())
+    rows = {
+        msg.id: msg for msg in (await db.scalars(
+            select(ChatMessage).where(ChatMessage.user_id == user_id, ChatMessage.id.in_(ids))
+        )).all()
+    }
+    root = rows.get(msg_id)
+    if not root:
+        raise HTTPException(status_code=404, detail="Message not found")
+    parent_id = root.parent_id if keep_parent and "parent_id" not in target.model_fields_set else target.parent_id
+    if parent_id and parent_id not in rows:
+        raise HTTPException(status_code=404, detail="Parent message not found")
+    return root, parent_id, rows[parent_id].ltree_path if parent_id else None
+
+def moved_root(root: ChatMessage, new_id, parent_id, ltree_path) -> ChatMessageOut:
+    """The subtree root as it reads after a copy or move, without reloading it"""
+    return ChatMessageOut.model_validate(root, from_attributes=True).model_copy(
+        update={"id": new_id, "parent_id": parent_id, "ltree_path": str(ltree_path)}
+    )
+
+def rebased_path(root_id, root_path, new_root_path):
+    """
+    ltree_path rewritten from under root_path to under new_root_path, as a
+    SQL expression over the subtree's rows. The root always gets a fresh
+    label, so the new paths can't collide with siblings at the destination
+    and branch summaries cached under the old paths are never reused.
+    """
+    new_root = literal(new_root_path, LtreeType)
+    return case(
+        (ChatMessage.id == root_id, new_root),
+        else_=new_root + func.subpath(ChatMessage.ltree_path, len(str(root_path).split("."))),
+    )
+
+@router.post("/chat/subtree/{msg_id}/copy", response_model=SubtreeOut)
+async def copy_subtree(
+    msg_id: uuid.UUID,
+    target: SubtreeTarget,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_principal),
+):
+    """
+    Copy a message and everything under it below `parent_id` with one
+    INSERT ... SELECT: every copy gets a new id, parent links are mapped to
+    the new ids and paths are rebased. Without `parent_id` the copy is made
+    next to the original, so the branch can be continued separately.
+    """
+    root, parent_id, parent_path = await load_subtree_target(db, user.id, msg_id, target, keep_parent=True)
+    root_path = root.ltree_path
+    new_root_id = uuid.uuid4()
+    new_root_path = new_ltree_path(parent_path)
+
+    # Materialized, so each row's new id is drawn once and shared by the
+    # row itself and the parent link of its children
+    source = (
+        select(
+            ChatMessage.id,
+            case((ChatMessage.id == msg_id, literal(new_root_id, ChatMessage.id.type)), else_=func.gen_random_uuid()).label("new_id"),
+            ChatMessage.parent_id,
+            rebased_path(msg_id, root_path, new_root_path).label("ltree_path"),
+            ChatMessage.content,
+            ChatMessage.is_user,
+            ChatMessage.timestamp,
+            ChatMessage.doc_id,
+        )
+        .where(ChatMessage.user_id == user.id, ChatMessage.ltree_path.descendant_of(root_path))
+        .cte("source")
+        .prefix_with("MATERIALIZED")
+    )
+    parent = source.alias("parent")
+    with stage("subtree_copy"):
+        result = await db.execute(insert(ChatMessage).from_select(
+            ["id", "user_id", "parent_id", "ltree_path", "content", "is_user", "timestamp", "doc_id"],
+            select(
+                source.c.new_id,
+                literal(user.id, ChatMessage.user_id.type),
+                case((source.c.id == msg_id, literal(parent_id, ChatMessage.parent_id.type)), else_=parent.c.new_id),
+                source.c.ltree_path,
+                source.c.content,
+                source.c.is_user,
+                source.c.timestamp,
+                source.c.doc_id,
+            ).outerjoin(parent, parent.c.id == source.c.parent_id),
+        ))
+        await db.commit()
+
+    return SubtreeOut(root=moved_root(root, new_root_id, parent_id, new_root_path), count=result.rowcount)
+
+@router.post("/chat/subtree/{msg_id}/move", response_model=SubtreeOut)
+async def move_subtree(
+    msg_id: uuid.UUID,
+    target: SubtreeTarget,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_principal),
+):
+    """
+    Re-parent a message under `parent_id` (null: make it a root), taking
+    everything under it along, with one UPDATE that rebases the paths.
+    """
+    root, parent_id, parent_path = await load_subtree_target(db, user.id, msg_id, target, keep_parent=False)
+    root_path = root.ltree_path
+    root_labels = str(root_path).split(".")
+    if parent_path is not None and str(parent_path).split(".")[:len(root_labels)] == root_labels:
+        raise HTTPException(status_code=400, detail="Cannot move a message under itself")
+    new_root_path = new_ltree_path(parent_path)
+
+    with stage("subtree_move"):
+        result = await db.execute(
+            update(ChatMessage)
+            .where(ChatMessage.user_id == user.id, ChatMessage.ltree_path.descendant_of(root_path))
+            .values(
+                ltree_path=rebased_path(msg_id, root_path, new_root_path),
+                parent_id=case((ChatMessage.id == msg_id, literal(parent_id, ChatMessage.parent_id.type)), else_=ChatMessage.parent_id),
+            ),
+            execution_options={"synchronize_session": False},
+        )
+        await db.commit()
+    return SubtreeOut(root=moved_root(root, root.id, parent_id, new_root_path), count=result.rowcount)
+
+# --- Bulk export and import ---
+ARCHIVE_FORMAT = "^(ndjson|csv)$"
+
+@router.get("/chat/export")
+async def export_chat_history(
+    format: str = Query("ndjson", pattern=ARCHIVE_FORMAT),
+    user: Principal = Depends(get_current_principal),
+):
+    """
+    Every message of the user, parents before children, streamed straight
+    from COPY ... TO STDOUT: one JSON object per line, or CSV with a header.
+    Either can be loaded again with POST /chat/import.
+    """
+    return StreamingResponse(
+        chat_archive.stream_export(AsyncSessionLocal, user.id, format),
+        media_type=chat_archive.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="chat-history.{format}"'},
+    )
+
+@router.post("/chat/import")
+async def import_chat_history(
+    request: Request,
+    format: str = Query("ndjson", pattern=ARCHIVE_FORMAT),
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_principal),
+):
+    """
+    Add an export, sent as the request body, to the user's history. The
+    body is streamed into COPY ... FROM STDIN, so it is never held in
+    memory. ids, parent links and paths are kept; the rows must form
+    complete trees that don't clash with existing messages, or nothing is
+    imported and the problems are counted in the 400 response.
+    """
+    try:
+        count = await chat_archive.import_messages(db, user.id, format, request.stream())
+    except chat_archive.ArchiveInvalid as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail={"error": "Import is not a consistent tree", "problems": e.problems})
+    except (asyncpg.PostgresError, DBAPIError) as e:
+        # Malformed rows: bad JSON or CSV, or values of the wrong type
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Unreadable {format}: {getattr(e, 'orig', e)}")
+    await db.commit()
+    return {"imported": count}
+
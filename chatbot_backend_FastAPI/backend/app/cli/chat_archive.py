@@ -0,0 +1,72 @@
+"""
+Export or import a user's chat history with PostgreSQL COPY, the same way
+GET /chat/export and POST /chat/import do, for backups and moving accounts
+between databases. Run from the backend directory with DATABASE_URL set:
+
+    python -m app.cli.chat_archive export alice --output alice.ndjson
+    python -m app.cli.chat_archive export alice --format csv > alice.csv
+    python -m app.cli.chat_archive import bob alice.ndjson
+
+Rows stream between the file and the database, so memory use does not
+grow with the size of the history. An import is all or nothing: ids,
+parent links and ltree paths are kept, and rows that don't form complete
+trees (or clash with existing messages) abort it with the problems
+counted. Prints one JSON line with the row count and rate to stderr.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from sqlalchemy import select
+from app.db.session import AsyncSessionLocal, async_engine
+from app.models.user import User
+from app.services import chat_archive
+
+
+async def find_user_id(db, username: str):
+    user_id = await db.scalar(select(User.id).where(User.username == username))
+    if user_id is None:
+        raise SystemExit(f"No user named {username!r}")
+    return user_id
+
+
+async def run(args) -> dict:
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            user_id = await find_user_id(db, args.username)
+            if args.command == "export":
+                output = sys.stdout.buffer if args.output == "-" else args.output
+                count = await chat_archive.export_messages(db, user_id, args.format, output)
+            else:
+                source = sys.stdin.buffer if args.file == "-" else args.file
+                try:
+                    count = await chat_archive.import_messages(db, user_id, args.format, source)
+                except chat_archive.ArchiveInvalid as e:
+                    raise SystemExit(json.dumps({"error": "Import is not a consistent tree", "problems": e.problems}))
+                await db.commit()
+    finally:
+        await async_engine.dispose()
+    seconds = time.perf_counter() - started
+    return {"command": args.command, "messages": count, "seconds": seconds, "messages_per_second": count / seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write a user's messages to a file")
+    export.add_argument("username")
+    export.add_argument("--output", default="-", help="file to write (default stdout)")
+    load = commands.add_parser("import", help="add messages from a file to a user's history")
+    load.add_argument("username")
+    load.add_argument("file", help="file to read, - for stdin")
+    for command in (export, load):
+        command.add_argument("--format", choices=chat_archive.FORMATS, default="ndjson")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args))), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
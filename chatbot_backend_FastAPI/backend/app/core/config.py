@@ -6,6 +6,120 @@ class Settings(BaseSettings):
     HUGGINGFACE_TOKEN: str
     LANGCHAIN_API_KEY: str
 
+    # Connection pool, applied to both the sync and the async (asyncpg) engine
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_TIMEOUT: int = 30
+
+    # A HuggingFace model name, or "hash:<dim>" for the model-free stand-in
+    # used by load tests (see bench/e2e.py)
+    EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    # Query embeddings from concurrent requests are flushed together once
+    # this many texts are queued or the first has waited this long
+    EMBED_BATCH_SIZE: int = 32
+    EMBED_MAX_WAIT_MS: float = 5.0
+    # Load the embedding model in the background at startup instead of on
+    # the first request; /health/ready reports 503 until it is warm
+    EMBEDDING_WARMUP: bool = True
+
+    # Vector store: one "library" Chroma collection for all documents, plus a
+    # BM25 index per doc_id, under this directory
+    VECTORSTORE_DIR: str = str(Path(__file__).resolve().parent.parent.parent / "vectorstores")
+    # Byte budget for BM25 indexes kept in RAM (measured by on-disk size)
+    VECTORSTORE_CACHE_BYTES: int = 512 * 1024 * 1024
+    # Chroma server for the library, e.g. http://chroma:8000 as set up by
+    # docker-compose.yml. Required when running more than one API process
+    # (uvicorn --workers, WEB_CONCURRENCY): with an embedded store a second
+    # process fails at startup. Empty keeps it embedded on disk
+    LIBRARY_CHROMA_URL: str | None = None
+
+    # Background PDF ingestion (parsing + embedding run in worker processes)
+    INGEST_WORKERS: int = 2
+    INGEST_EMBED_BATCH_SIZE: int = 64
+    # The API process touches its unfinished jobs every INGEST_HEARTBEAT
+    # seconds; one untouched for INGEST_STALE_AFTER was lost to a crash or
+    # restart and counts as failed
+    INGEST_HEARTBEAT: float = 30.0
+    INGEST_STALE_AFTER: float = 120.0
+    # Uploads are streamed to disk in chunks of this size and refused (413)
+    # past the cap
+    UPLOAD_MAX_BYTES: int = 200 * 1024 * 1024
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+
+    # LLM backend (OpenAI-compatible chat completions)
+    LLM_API_URL: str = "https://router.huggingface.co/novita/v3/openai/chat/completions"
+    LLM_MAX_CONNECTIONS: int = 20
+    LLM_MAX_KEEPALIVE: int = 10
+    # Requests in flight at once per worker; the rest wait for a slot
+    LLM_CONCURRENCY: int = 16
+    # Overall deadline per call, including queueing and retries (seconds).
+    # A streamed call has it until its first line, then may go quiet for at
+    # most LLM_STREAM_IDLE_TIMEOUT between lines
+    LLM_TIMEOUT: float = 60.0
+    LLM_STREAM_IDLE_TIMEOUT: float = 30.0
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_MAX_RETRIES: int = 3
+    LLM_BACKOFF_BASE: float = 0.5
+    # Fair scheduling of chat calls: each user may ask LLM_USER_RATE
+    # questions per second in bursts of LLM_USER_BURST (0 turns the limit
+    # off). Calls beyond LLM_CONCURRENCY wait, at most LLM_QUEUE_MAX of
+    # them, and one that would wait longer than LLM_QUEUE_TIMEOUT seconds
+    # gets 503 instead
+    LLM_USER_RATE: float = 0.5
+    LLM_USER_BURST: int = 5
+    # /rag/ask-doc is limited per client address, which a whole campus can
+    # share behind NAT, so it is off by default. Behind a reverse proxy, run
+    # uvicorn with --proxy-headers and FORWARDED_ALLOW_IPS set to the proxy
+    # so the address is the client's rather than the proxy's
+    LLM_ANONYMOUS_RATE: float = 0.0
+    LLM_ANONYMOUS_BURST: int = 5
+    LLM_QUEUE_MAX: int = 256
+    LLM_QUEUE_TIMEOUT: float = 15.0
+
+    # Cache of LLM answers: "memory" (per worker) or "redis" (shared)
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_BACKEND: str = "memory"
+    RESPONSE_CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    RESPONSE_CACHE_TTL: int = 60 * 60
+    RESPONSE_CACHE_MAX_ENTRIES: int = 10000
+    # Optional similarity tier: reuse answers to paraphrased questions
+    RESPONSE_CACHE_SEMANTIC: bool = False
+    RESPONSE_CACHE_SIMILARITY: float = 0.95
+
+    # Retrieval: BM25 + dense search fused by rank; k, mmr and score_threshold
+    # are the per-request defaults, fetch_k the candidates taken from each side
+    RETRIEVAL_HYBRID: bool = True
+    RETRIEVAL_K: int = 4
+    RETRIEVAL_FETCH_K: int = 20
+    RETRIEVAL_MMR: bool = False
+    RETRIEVAL_MMR_LAMBDA: float = 0.5
+    RETRIEVAL_SCORE_THRESHOLD: float = 0.0
+
+    # Conversation history for /rag/chat: the ancestor chain of the parent
+    # message, trimmed to a token budget, with cached summaries of older turns
+    CONVERSATION_CONTEXT_ENABLED: bool = True
+    CONVERSATION_TOKEN_BUDGET: int = 1024
+    CONVERSATION_MAX_MESSAGES: int = 200
+    # A branch summary is made every this many levels of the tree
+    CONVERSATION_SUMMARY_EVERY: int = 6
+    CONVERSATION_SUMMARY_TTL: int = 24 * 60 * 60
+
+    # Verified users kept in memory so authenticated requests skip the users query
+    AUTH_CACHE_TTL: int = 60
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+
+    # Password hashing: bcrypt cost, dedicated threads, and how many hashes may
+    # be admitted at once before logins/registrations get 429
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 32
+
+    # "X-Profile: 1" on a request returns its stage timings in a Server-Timing
+    # header (/metrics always has the aggregates); turn off where clients
+    # should not see them
+    METRICS_PROFILING_ENABLED: bool = True
+
     class Config:
         env_file = str(Path(__file__).resolve().parent.parent.parent.parent.parent / ".env")
         case_sensitive = True
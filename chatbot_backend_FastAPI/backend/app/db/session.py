@@ -1,12 +1,40 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.core.config import settings
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+def _async_url(url: str) -> str:
+    # Same database, asyncpg driver
+    for prefix in ("postgresql+psycopg2://", "postgresql+psycopg://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+POOL_OPTIONS = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+)
+
+# Sync engine: Alembic, ingestion worker processes and other sync code
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine used by the API handlers
+async_engine = create_async_engine(_async_url(SQLALCHEMY_DATABASE_URL), **POOL_OPTIONS)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+@event.listens_for(async_engine.sync_engine, "connect")
+def _register_ltree_codec(dbapi_connection, connection_record):
+    # asyncpg has no codec for the ltree extension type; exchange it as text
+    dbapi_connection.run_async(
+        lambda conn: conn.set_type_codec("ltree", encoder=str, decoder=str, schema="public", format="text")
+    )
+
 # ✅ This is the missing part
 Base = declarative_base()
 def get_db():
@@ -14,4 +42,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
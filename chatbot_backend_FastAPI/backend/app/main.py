@@ -1,8 +1,15 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes import response
 from app.api.routes import rag_chat
 from app.api.routes import db_check
+from app.api.routes import health
+from app.api.routes import metrics as metrics_routes
+from app.core.config import settings
+from app.services import ingestion, metrics
+from app.services.llm_client import close_llm_client
+import threading
+import time
 
 app = FastAPI()
 
@@ -12,8 +19,62 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Stages timed anywhere in the request land in this breakdown
+    breakdown = metrics.start_breakdown()
+    started = time.perf_counter()
+    status = 500
+    metrics.http_requests_in_progress.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        metrics.http_requests_in_progress.dec()
+        elapsed = time.perf_counter() - started
+        # The route template, not the raw path, keeps the label set small
+        route = request.scope.get("route")
+        metrics.http_request_seconds.observe(
+            elapsed, method=request.method, route=route.path if route else "unmatched", status=status
+        )
+    # Opt-in per request; streamed answers only show what ran before the first byte
+    if settings.METRICS_PROFILING_ENABLED and request.headers.get("X-Profile") == "1":
+        response.headers["Server-Timing"] = metrics.server_timing(breakdown, elapsed)
+    return response
+
 app.include_router(response.router)
 app.include_router(rag_chat.router)
 app.include_router(db_check.router)
+app.include_router(health.router)
+app.include_router(metrics_routes.router)
+
+@app.on_event("startup")
+def claim_vectorstore():
+    # An embedded library serves one API process; more need LIBRARY_CHROMA_URL
+    rag_chat.doc_vectorstores.claim()
+
+@app.on_event("startup")
+def warm_embedding_model():
+    if settings.EMBEDDING_WARMUP:
+        # Load in the background so the worker answers requests right away
+        threading.Thread(target=rag_chat.embedding_model.warm, name="embedding-warmup", daemon=True).start()
+
+@app.on_event("startup")
+def fail_abandoned_ingestion_jobs():
+    # Jobs a crashed or restarted process left unfinished would stay "running" forever
+    ingestion.fail_abandoned()
+
+@app.on_event("shutdown")
+def shutdown_ingestion_workers():
+    ingestion.shutdown()
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    response.password_hasher.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_llm_client():
+    await close_llm_client()
@@ -1,5 +1,7 @@
 from .user import User  # Import User model first
 from .chat_message import ChatMessage  # Then import ChatMessage that depends on User
+from .ingestion_job import IngestionJob
+from .user_document import UserDocument
 
 
 # This ensures models are registered with SQLAlchemy in the correct order
@@ -1,7 +1,7 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, event
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, Index, event, select
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy_utils import LtreeType, Ltree
-from sqlalchemy.orm import relationship, Mapped
+from sqlalchemy.orm import relationship, backref, Mapped
 import uuid
 import datetime
 from app.db.session import Base
@@ -9,6 +9,13 @@ from typing import Optional
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Every tree query filters by user first, then orders or ranges on these
+        Index("ix_chat_messages_user_id_ltree_path", "user_id", "ltree_path"),
+        Index("ix_chat_messages_user_id_timestamp", "user_id", "timestamp"),
+        # descendant_of / ancestor_of (<@, @>) can only use a GiST index
+        Index("ix_chat_messages_ltree_path_gist", "ltree_path", postgresql_using="gist"),
+    )
 
     @property
     def ltree_path_str(self) -> str:
@@ -19,27 +26,26 @@ class ChatMessage(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
 
     # Self-referencing parent ID
-    parent_id = Column(UUID(as_uuid=True), ForeignKey("chat_messages.id"), nullable=True)
+    parent_id = Column(UUID(as_uuid=True), ForeignKey("chat_messages.id"), nullable=True, index=True)
 
     # ltree path for hierarchical queries
     ltree_path = Column(LtreeType, nullable=False, index=True)
 
-    def _create_ltree_path(self):
+    def _create_ltree_path(self, connection):
         """Create ltree path based on parent's path or message id if no parent"""
         if not self.ltree_path:
-            # If ltree_path is already set (from the route), use that
-            # This happens when we explicitly set it during message creation
+            # Routes compute the path in memory (see new_ltree_path); this is
+            # only the fallback for writers that leave it unset, and costs
+            # one extra query for the parent's path
             if self.parent_id is None:
                 # Root message - use its own ID as path
                 return Ltree(str(self.id).replace('-', '_'))
             else:
-                # Get parent from database
-                from sqlalchemy.orm import object_session
-                session = object_session(self)
-                if session:
-                    parent = session.query(ChatMessage).filter(ChatMessage.id == self.parent_id).first()
-                    if parent and parent.ltree_path:
-                        return Ltree(f"{str(parent.ltree_path)}.{str(self.id).replace('-', '_')}")
+                parent_path = connection.scalar(
+                    select(ChatMessage.ltree_path).where(ChatMessage.id == self.parent_id)
+                )
+                if parent_path:
+                    return Ltree(f"{str(parent_path)}.{str(self.id).replace('-', '_')}")
                 # Fallback to using just the ID if something goes wrong
                 return Ltree(str(self.id).replace('-', '_'))
         return self.ltree_path
@@ -49,18 +55,24 @@ class ChatMessage(Base):
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     doc_id = Column(String, nullable=True)
 
-    # ✅ Correct self-referential relationship
+    # ✅ Correct self-referential relationship.
+    # Never loaded implicitly: queries that need it ask with selectinload/joinedload
     parent = relationship(
         "ChatMessage",
         remote_side=[id],
         foreign_keys=[parent_id],
-        backref="children",
-        lazy="joined"
+        backref=backref("children", lazy="raise_on_sql"),
+        lazy="raise_on_sql"
     )
 
     # ✅ Link to User model
     user = relationship("User", backref="messages")
 
+def new_ltree_path(parent_path=None) -> Ltree:
+    """Path for a new message: a fresh label under parent_path, or a new root"""
+    label = uuid.uuid4().hex[:8]
+    return Ltree(f"{parent_path}.{label}") if parent_path else Ltree(label)
+
 @event.listens_for(ChatMessage, 'before_insert')
 def _set_ltree_path(mapper, connection, target):
-    target.ltree_path = target._create_ltree_path()
+    target.ltree_path = target._create_ltree_path(connection)
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, String, DateTime, Float, Text
+from sqlalchemy.dialects.postgresql import UUID
+import uuid
+import datetime
+from app.db.session import Base
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    doc_id = Column(String, nullable=False, index=True)
+    filename = Column(String, nullable=True)
+    # SHA-256 of the uploaded file; identical uploads share one doc_id
+    content_hash = Column(String, nullable=True, index=True)
+
+    # queued -> running -> done | failed
+    status = Column(String, nullable=False, default="queued")
+    # parse -> embed -> index
+    stage = Column(String, nullable=True)
+    # Overall progress from 0.0 to 1.0
+    progress = Column(Float, nullable=False, default=0.0)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+import datetime
+from app.db.session import Base
+
+class UserDocument(Base):
+    """A document in a user's library; identical uploads share one doc_id across users"""
+    __tablename__ = "user_documents"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    doc_id = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,179 @@
+from contextlib import suppress
+from sqlalchemy import text
+import asyncio
+from app.services.metrics import stage
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Exported per message, in this order for CSV; the owner is whoever imports
+COLUMNS = ("id", "parent_id", "ltree_path", "content", "is_user", "timestamp", "doc_id")
+
+# NDJSON goes through COPY as one-column CSV with a delimiter and quote
+# character that JSON never contains unescaped, so lines pass through as is
+COPY_OPTIONS = {
+    "ndjson": {"format": "csv", "delimiter": "\x02", "quote": "\x01"},
+    "csv": {"format": "csv", "header": True},
+}
+
+EXPORT_QUERY = f"""
+    SELECT {", ".join(COLUMNS)} FROM chat_messages
+    WHERE user_id = $1
+    ORDER BY ltree_path
+"""
+
+STAGING_TABLES = ("""
+    CREATE TEMP TABLE chat_import (
+        id uuid,
+        parent_id uuid,
+        ltree_path ltree,
+        content text,
+        is_user boolean,
+        "timestamp" timestamp,
+        doc_id text
+    ) ON COMMIT DROP
+""", """
+    CREATE TEMP TABLE chat_import_lines (line text) ON COMMIT DROP
+""")
+
+PARSE_LINES = """
+    INSERT INTO chat_import
+    SELECT record.* FROM chat_import_lines,
+        json_populate_record(NULL::chat_import, line::json) AS record
+    WHERE line <> ''
+"""
+
+# Every check in one pass over the staged rows; each count is a kind of problem
+VALIDATE = """
+    SELECT
+        count(*) AS messages,
+        count(*) FILTER (WHERE m.id IS NULL OR m.ltree_path IS NULL OR m.content IS NULL) AS missing_fields,
+        (SELECT count(*) FROM (SELECT id FROM chat_import GROUP BY id HAVING count(*) > 1) d) AS duplicate_ids,
+        -- Grouped as text so it can be hashed instead of sorted
+        (SELECT count(*) FROM (SELECT ltree_path::text FROM chat_import GROUP BY 1 HAVING count(*) > 1) d) AS duplicate_paths,
+        count(*) FILTER (WHERE m.parent_id IS NOT NULL AND parent.id IS NULL) AS missing_parents,
+        count(*) FILTER (WHERE
+            CASE WHEN m.parent_id IS NULL THEN nlevel(m.ltree_path) <> 1
+            ELSE parent.id IS NOT NULL AND NOT (
+                m.ltree_path <@ parent.ltree_path AND nlevel(m.ltree_path) = nlevel(parent.ltree_path) + 1
+            ) END
+        ) AS bad_paths,
+        -- Only a root can land on an existing path; everything else is under one
+        count(*) FILTER (WHERE
+            EXISTS (SELECT 1 FROM chat_messages existing WHERE existing.id = m.id)
+            OR m.parent_id IS NULL AND EXISTS (
+                SELECT 1 FROM chat_messages existing
+                WHERE existing.user_id = CAST(:user_id AS uuid) AND existing.ltree_path = m.ltree_path
+            )
+        ) AS conflicts
+    FROM chat_import m
+    LEFT JOIN chat_import parent ON parent.id = m.parent_id
+"""
+
+INSERT = """
+    INSERT INTO chat_messages (id, user_id, parent_id, ltree_path, content, is_user, "timestamp", doc_id)
+    SELECT id, CAST(:user_id AS uuid), parent_id, ltree_path, content,
+        coalesce(is_user, true), coalesce("timestamp", now() AT TIME ZONE 'utc'), doc_id
+    FROM chat_import
+"""
+
+STREAM_QUEUE_CHUNKS = 64
+
+
+class ArchiveInvalid(Exception):
+    """The imported rows do not form a consistent tree; nothing was written"""
+
+    def __init__(self, problems: dict):
+        super().__init__(", ".join(f"{name}: {count}" for name, count in problems.items()))
+        self.problems = problems
+
+
+def export_query(format: str) -> str:
+    if format == "ndjson":
+        return f"SELECT row_to_json(m) FROM ({EXPORT_QUERY}) m"
+    return EXPORT_QUERY
+
+
+async def driver_connection(db):
+    """The asyncpg connection under an AsyncSession, inside its transaction"""
+    connection = await db.connection()
+    return (await connection.get_raw_connection()).driver_connection
+
+
+async def export_messages(db, user_id, format: str, output) -> int:
+    """
+    COPY a user's messages, parents before children, to `output`: a path,
+    a binary file object, or a coroutine function taking bytes. Returns the
+    number of messages.
+    """
+    conn = await driver_connection(db)
+    status = await conn.copy_from_query(export_query(format), user_id, output=output, **COPY_OPTIONS[format])
+    return int(status.split()[-1])
+
+
+async def stream_export(session_factory, user_id, format: str):
+    """
+    Yield an export as it comes off the COPY. A bounded queue sits between
+    the two, so a slow client holds back the COPY instead of the whole
+    history piling up in memory.
+    """
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+
+    async def collect(chunk):
+        # asyncpg hands over bytearrays; responses take bytes
+        await queue.put(bytes(chunk))
+
+    async def copy():
+        try:
+            async with session_factory() as db:
+                await export_messages(db, user_id, format, collect)
+        except BaseException:
+            # The reader also stops once the task is done and the queue is drained
+            with suppress(asyncio.QueueFull):
+                queue.put_nowait(None)
+            raise
+        await queue.put(None)
+
+    task = asyncio.create_task(copy())
+    try:
+        while not (queue.empty() and task.done()):
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            yield chunk
+        await task
+    finally:
+        task.cancel()
+
+
+async def import_messages(db, user_id, format: str, source) -> int:
+    """
+    COPY messages from `source` (a path, a binary file object or an async
+    iterable of bytes) into a staging table, check them in bulk and insert
+    them for user_id with one INSERT ... SELECT. ids, parent links and
+    ltree paths are kept as they are, so every parent must be in the same
+    import. Raises ArchiveInvalid, writing nothing, when the rows don't form
+    a consistent tree. The caller commits.
+    """
+    # Run through the session first, so the COPY joins its transaction
+    for statement in STAGING_TABLES:
+        await db.execute(text(statement))
+    conn = await driver_connection(db)
+    with stage("import_copy"):
+        if format == "ndjson":
+            await conn.copy_to_table("chat_import_lines", source=source, columns=["line"], **COPY_OPTIONS[format])
+            await db.execute(text(PARSE_LINES))
+        else:
+            await conn.copy_to_table("chat_import", source=source, columns=list(COLUMNS), **COPY_OPTIONS[format])
+        # Temporary tables are never analyzed automatically
+        await db.execute(text("ANALYZE chat_import"))
+
+    with stage("import_validate"):
+        checks = (await db.execute(text(VALIDATE), {"user_id": user_id})).mappings().one()
+    problems = {name: count for name, count in checks.items() if name != "messages" and count}
+    if problems:
+        raise ArchiveInvalid(problems)
+
+    with stage("import_insert"):
+        await db.execute(text(INSERT), {"user_id": user_id})
+    return checks["messages"]
@@ -0,0 +1,148 @@
+from sqlalchemy import func, select
+from app.models.chat_message import ChatMessage
+import asyncio
+
+SUMMARY_PREFIX = "branch-summary:"
+
+
+def estimate_tokens(text: str) -> int:
+    # About 4 characters per token for English text; close enough for a budget
+    return len(text) // 4 + 1
+
+
+def _depth(path) -> int:
+    return str(path).count(".") + 1
+
+
+def _format_turn(message) -> str:
+    return f"{'User' if message.is_user else 'Assistant'}: {message.content}"
+
+
+async def fetch_ancestor_chain(db, user_id, message_id, limit: int = 200):
+    """
+    The message and its ancestors, root first, from a single ancestor_of
+    query. Empty when the message does not exist or belongs to someone else.
+    Only the deepest `limit` messages are returned; branch summaries cover
+    anything older.
+    """
+    target = (
+        select(ChatMessage.ltree_path)
+        .where(ChatMessage.id == message_id, ChatMessage.user_id == user_id)
+        .scalar_subquery()
+    )
+    rows = (await db.execute(
+        select(ChatMessage.id, ChatMessage.ltree_path, ChatMessage.is_user, ChatMessage.content)
+        .where(ChatMessage.user_id == user_id, ChatMessage.ltree_path.ancestor_of(target))
+        .order_by(func.nlevel(ChatMessage.ltree_path).desc())
+        .limit(limit)
+    )).all()
+    return rows[::-1]
+
+
+class ConversationContextBuilder:
+    """
+    Turns an ancestor chain into a prompt-sized history.
+
+    Recent turns are kept verbatim, newest first, until `token_budget` runs
+    out. Older turns are represented by a branch summary: every
+    `summary_every` levels the branch gets a summary of everything above that
+    point, made in the background by `summarize` and cached under the node's
+    ltree path; `summarize(text, user)` is called for the user whose turn
+    needed it. All branches forking below a node share its summary, and each
+    summary builds on the previous one, so no call ever re-reads the whole
+    history. Summaries are only made once a branch fills SUMMARY_START of the
+    budget, so a conversation that fits never costs a summarization call.
+    """
+
+    # Share of token_budget a branch fills before summaries are made for it,
+    # early enough that one is usually ready when the budget runs out
+    SUMMARY_START = 0.75
+
+    def __init__(self, backend, summarize, token_budget: int = 1024, summary_every: int = 6, summary_ttl: int = 86400):
+        self.backend = backend
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.summary_every = summary_every
+        self.summary_ttl = summary_ttl
+        self._in_flight = set()  # paths being summarized right now
+        self._tasks = set()
+
+    async def build(self, chain, user: str = "anonymous") -> str:
+        if not chain:
+            return ""
+        turns, first = self._recent_turns(chain, self.token_budget)
+        summary = None
+        if first > 0:
+            # Older turns did not fit: use the deepest summary that reaches the
+            # window, and keep verbatim only what comes after it
+            summary, start = await self._latest_summary(chain[: first + 1])
+            if summary:
+                summary = summary[: self.token_budget // 2 * 4]
+                turns, _ = self._recent_turns(chain[start:], self.token_budget - estimate_tokens(summary))
+        if first > 0 or self._tokens(chain) >= self.token_budget * self.SUMMARY_START:
+            self._schedule_summary(chain, user)
+
+        parts = [f"Summary of the earlier conversation: {summary}"] if summary else []
+        return "\n".join(parts + turns)
+
+    @staticmethod
+    def _tokens(chain) -> int:
+        return sum(estimate_tokens(_format_turn(message)) for message in chain)
+
+    @staticmethod
+    def _recent_turns(chain, budget: int):
+        """(turns, index of the oldest one kept): newest turns first until budget runs out"""
+        turns = []
+        first = len(chain)
+        for index in range(len(chain) - 1, -1, -1):
+            turn = _format_turn(chain[index])
+            budget -= estimate_tokens(turn)
+            if budget < 0:
+                break
+            turns.append(turn)
+            first = index
+        return turns[::-1], first
+
+    async def _latest_summary(self, chain):
+        """(summary, index of the first message after it) for the deepest cached summary"""
+        for index in range(len(chain) - 1, -1, -1):
+            if _depth(chain[index].ltree_path) % self.summary_every:
+                continue
+            summary = await self.backend.get(SUMMARY_PREFIX + str(chain[index].ltree_path))
+            if summary is not None:
+                return summary, index + 1
+        return None, 0
+
+    def _schedule_summary(self, chain, user: str):
+        # The deepest node on a summary level, if it is not summarized yet
+        for index in range(len(chain) - 1, -1, -1):
+            if _depth(chain[index].ltree_path) % self.summary_every == 0:
+                break
+        else:
+            return
+        path = str(chain[index].ltree_path)
+        if path in self._in_flight:
+            return
+        self._in_flight.add(path)
+        task = asyncio.create_task(self._summarize(chain[: index + 1], path, user))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, chain, path, user: str):
+        try:
+            if await self.backend.get(SUMMARY_PREFIX + path) is not None:
+                return
+            previous, start = await self._latest_summary(chain[:-1])
+            # Bound the input: the previous summary plus the newest turns that fit
+            turns, _ = self._recent_turns(chain[start:], self.token_budget * 4)
+            text = "\n".join(turns)
+            if previous:
+                text = f"Earlier summary: {previous}\n{text}"
+            summary = await self.summarize(text, user)
+            if summary:
+                await self.backend.set(SUMMARY_PREFIX + path, summary, self.summary_ttl)
+        except Exception:
+            # A missing summary only means less history in the prompt
+            pass
+        finally:
+            self._in_flight.discard(path)
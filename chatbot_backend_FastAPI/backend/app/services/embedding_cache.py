@@ -0,0 +1,53 @@
+import hashlib
+import sqlite3
+import numpy as np
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ChunkEmbeddingCache:
+    """
+    Content-addressed store of chunk embeddings.
+
+    Vectors are keyed by (model name, SHA-256 of the chunk text) in a SQLite
+    file next to the vector stores, so a chunk that was embedded for any
+    earlier upload is never sent through the model again. Every ingestion
+    process opens its own connection.
+    """
+
+    def __init__(self, path: str, model_name: str):
+        self.model_name = model_name
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embeddings ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, hashes) -> dict:
+        found = {}
+        hashes = list(set(hashes))
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT hash, vector FROM chunk_embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                [self.model_name, *batch],
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, vectors: dict):
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO chunk_embeddings (model, hash, vector) VALUES (?, ?, ?)",
+            [(self.model_name, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()],
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,178 @@
+from concurrent.futures import Future
+from app.services.lexical_index import tokenize
+import asyncio
+import hashlib
+import queue
+import threading
+import time
+import numpy as np
+
+# EMBEDDING_MODEL=hash:<dim> selects HashingEmbeddings instead of a real model
+HASHING_PREFIX = "hash:"
+
+
+def load_embeddings(model_name: str):
+    """The embedding model for model_name, as used by the API and ingestion workers"""
+    if model_name.startswith(HASHING_PREFIX):
+        return HashingEmbeddings(int(model_name[len(HASHING_PREFIX):]))
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+class HashingEmbeddings:
+    """
+    Stand-in for a sentence embedding model: each term is hashed into one of
+    `dim` buckets and the counts are L2-normalised. Deterministic across
+    processes and needs no download, so load tests and benchmarks can run
+    the whole pipeline without the real model. Texts sharing terms score as
+    similar, which is enough to exercise retrieval.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term in tokenize(text):
+            digest = hashlib.blake2b(term.encode(), digest_size=8).digest()
+            vector[int.from_bytes(digest, "little") % self.dim] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+class BatchingEmbeddings:
+    """
+    Micro-batching front for an embedding model.
+
+    Every embed call from any request is queued; one dedicated thread owns
+    the model and drains the queue in batches, flushing when `max_batch_size`
+    texts are waiting or `max_wait_ms` has passed since the first one
+    arrived. Concurrent questions therefore share one forward pass instead
+    of running the model once each.
+
+    The model itself is built by `load_model` on first use, or earlier by
+    calling warm(), so importing the app never pays for it.
+    """
+
+    def __init__(self, load_model, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.load_model = load_model
+        self.model = None
+        self.state = "cold"  # cold -> loading -> warm | failed
+        self.load_seconds = None
+        self._model_lock = threading.Lock()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._counters = {"requests": 0, "texts": 0, "batches": 0, "busy_seconds": 0.0}
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._submit([text]).result()[0]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return self._submit(texts).result()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await asyncio.wrap_future(self._submit([text])))[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return await asyncio.wrap_future(self._submit(texts))
+
+    def warm(self):
+        """Load the model now (blocking) and start the batching thread"""
+        self._get_model()
+        self._ensure_worker()
+
+    @property
+    def is_warm(self) -> bool:
+        return self.state == "warm"
+
+    def stats(self) -> dict:
+        counters = dict(self._counters)
+        uptime = time.monotonic() - self._started_at
+        return {
+            **counters,
+            "model_state": self.state,
+            "model_load_seconds": self.load_seconds,
+            "queue_depth": self._queue.qsize(),
+            "avg_batch_size": counters["texts"] / counters["batches"] if counters["batches"] else 0.0,
+            "texts_per_second": counters["texts"] / uptime if uptime else 0.0,
+            "utilization": counters["busy_seconds"] / uptime if uptime else 0.0,
+        }
+
+    def _submit(self, texts: list[str]) -> Future:
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+
+    def _get_model(self):
+        if self.model is None:
+            with self._model_lock:
+                if self.model is None:
+                    self.state = "loading"
+                    started = time.monotonic()
+                    try:
+                        self.model = self.load_model()
+                    except Exception:
+                        self.state = "failed"
+                        raise
+                    self.load_seconds = time.monotonic() - started
+                    self.state = "warm"
+        return self.model
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            self._flush(pending)
+
+    def _flush(self, pending):
+        texts = [text for item_texts, _ in pending for text in item_texts]
+        started = time.monotonic()
+        try:
+            vectors = np.asarray(self._get_model().embed_documents(texts), dtype=np.float32)
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        finally:
+            self._counters["busy_seconds"] += time.monotonic() - started
+
+        self._counters["requests"] += len(pending)
+        self._counters["texts"] += len(texts)
+        self._counters["batches"] += 1
+        offset = 0
+        for item_texts, future in pending:
+            future.set_result(vectors[offset:offset + len(item_texts)].tolist())
+            offset += len(item_texts)
@@ -0,0 +1,307 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.ingestion_job import IngestionJob
+from app.services.embedding_cache import ChunkEmbeddingCache, chunk_hash
+from app.services.embedding_service import load_embeddings
+from app.services import metrics
+import datetime
+import json
+import multiprocessing
+import os
+import threading
+
+# Share of overall progress reached when each stage starts. Pages are split
+# and embedded as they are read, so "embed" covers splitting too.
+STAGE_PROGRESS = {
+    "parse": 0.0,
+    "embed": 0.05,
+    "index": 0.9,
+}
+
+# Chunks per batch read back from the spool file into the library
+INDEX_BATCH_SIZE = 1000
+
+UNFINISHED = ("queued", "running")
+
+_executor = None
+_executor_lock = threading.Lock()
+# Library writes happen in the API process, one at a time
+_writer = None
+# Jobs submitted by this process and not finished yet, kept fresh by the heartbeat
+_active = set()
+_active_lock = threading.Lock()
+_heartbeat = None
+_stopping = threading.Event()
+
+# Per worker process; loaded on the first job the process runs
+_embedding_model = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: torch and the DB pool do not survive a fork
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.INGEST_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _drop_executor(broken: ProcessPoolExecutor):
+    """Forget a pool whose worker died, so the next job starts a new one"""
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def get_writer() -> ThreadPoolExecutor:
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="library-writer")
+    return _writer
+
+
+def shutdown():
+    global _executor, _writer
+    _stopping.set()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _writer is not None:
+        _writer.shutdown(wait=False, cancel_futures=True)
+        _writer = None
+    # Queued jobs were just cancelled and running ones die with the process
+    with _active_lock:
+        interrupted = list(_active)
+        _active.clear()
+    if interrupted:
+        _fail_jobs(IngestionJob.id.in_(interrupted), error="Interrupted by a shutdown; upload the file again")
+
+
+def is_stale(job) -> bool:
+    """An unfinished job that no process has touched lately; it will never finish"""
+    return job.status in UNFINISHED and job.updated_at < _stale_before()
+
+
+def fail_abandoned() -> int:
+    """Mark stale unfinished jobs, left by a crash or restart, as failed"""
+    return _fail_jobs(
+        IngestionJob.status.in_(UNFINISHED),
+        IngestionJob.updated_at < _stale_before(),
+        error="Interrupted before it finished; upload the file again",
+    )
+
+
+def _stale_before() -> datetime.datetime:
+    return datetime.datetime.utcnow() - datetime.timedelta(seconds=settings.INGEST_STALE_AFTER)
+
+
+def _fail_jobs(*conditions, error: str) -> int:
+    db = SessionLocal()
+    try:
+        count = (
+            db.query(IngestionJob)
+            .filter(*conditions, IngestionJob.status.in_(UNFINISHED))
+            .update({"status": "failed", "error": error}, synchronize_session=False)
+        )
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def _start_heartbeat():
+    global _heartbeat
+    with _active_lock:
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_beat, name="ingestion-heartbeat", daemon=True)
+            _heartbeat.start()
+
+
+def _beat():
+    while not _stopping.wait(settings.INGEST_HEARTBEAT):
+        with _active_lock:
+            active = list(_active)
+        if not active:
+            continue
+        db = SessionLocal()
+        try:
+            db.query(IngestionJob).filter(
+                IngestionJob.id.in_(active), IngestionJob.status.in_(UNFINISHED)
+            ).update({"updated_at": datetime.datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+        except Exception:
+            # A missed beat only matters after INGEST_STALE_AFTER; try again next time
+            db.rollback()
+        finally:
+            db.close()
+
+
+def submit(job_id: str, doc_id: str, path: str, store):
+    """
+    Queue a PDF for ingestion; progress is written to the job row.
+
+    A worker process parses and embeds it into a spool file next to it;
+    `store` then indexes the spool on the writer thread, since the library
+    is written from this process.
+    """
+    spool_path = f"{path}.chunks.jsonl"
+    with _active_lock:
+        _active.add(job_id)
+    _start_heartbeat()
+    try:
+        executor = get_executor()
+        try:
+            future = executor.submit(ingest_pdf, job_id, doc_id, path, spool_path)
+        except BrokenProcessPool:
+            # A worker died since the last upload (killed for memory, say)
+            _drop_executor(executor)
+            executor = get_executor()
+            future = executor.submit(ingest_pdf, job_id, doc_id, path, spool_path)
+    except Exception:
+        with _active_lock:
+            _active.discard(job_id)
+        raise
+    future.add_done_callback(lambda done: get_writer().submit(_index, job_id, doc_id, done, path, spool_path, store, executor))
+    return future
+
+
+def _index(job_id: str, doc_id: str, future, path: str, spool_path: str, store, executor):
+    try:
+        try:
+            chunks = future.result()
+        except BrokenProcessPool:
+            # The worker died mid-job and took the pool with it; every job
+            # still in it fails, and the next upload gets a new pool
+            _drop_executor(executor)
+            if os.path.exists(path):
+                os.remove(path)
+            raise RuntimeError("Ingestion worker exited unexpectedly")
+        if chunks is None:
+            # The worker already marked the job failed
+            metrics.ingestion_jobs.inc(status="failed")
+            return
+        _update_job(job_id, stage="index", progress=STAGE_PROGRESS["index"])
+        store.write_batches(doc_id, _read_spool(spool_path, INDEX_BATCH_SIZE))
+        _update_job(job_id, status="done", progress=1.0)
+        metrics.ingestion_jobs.inc(status="done")
+    except Exception as e:
+        _update_job(job_id, status="failed", error=str(e) or type(e).__name__)
+        metrics.ingestion_jobs.inc(status="failed")
+    finally:
+        with _active_lock:
+            _active.discard(job_id)
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+
+def _read_spool(spool_path: str, batch_size: int):
+    """(texts, metadatas, embeddings) batches of at most batch_size chunks"""
+    with open(spool_path) as f:
+        batch = []
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield _columns(batch)
+                batch = []
+        if batch:
+            yield _columns(batch)
+
+
+def _columns(records):
+    return [r["text"] for r in records], [r["metadata"] for r in records], [r["embedding"] for r in records]
+
+
+def _update_job(job_id: str, **fields):
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job:
+            for key, value in fields.items():
+                setattr(job, key, value)
+            db.commit()
+    finally:
+        db.close()
+
+
+def _get_embedding_model():
+    global _embedding_model
+    if _embedding_model is None:
+        _embedding_model = load_embeddings(settings.EMBEDDING_MODEL)
+    return _embedding_model
+
+
+def _embed_batch(chunks, cache, spool) -> int:
+    """Embed chunks, reusing cached vectors, and append them to the spool"""
+    texts = [chunk.page_content for chunk in chunks]
+    hashes = [chunk_hash(text) for text in texts]
+    vectors = cache.get_many(hashes)
+    missing = {h: text for h, text in zip(hashes, texts) if h not in vectors}
+    if missing:
+        new_vectors = dict(zip(missing, _get_embedding_model().embed_documents(list(missing.values()))))
+        cache.put_many(new_vectors)
+        vectors.update(new_vectors)
+    for chunk, h in zip(chunks, hashes):
+        spool.write(json.dumps({"text": chunk.page_content, "metadata": chunk.metadata, "embedding": vectors[h]}) + "\n")
+    return len(chunks)
+
+
+def ingest_pdf(job_id: str, doc_id: str, path: str, spool_path: str):
+    """
+    Parse, split and embed one PDF. Runs in a worker process.
+
+    Pages are loaded one at a time, split, and embedded in batches of
+    INGEST_EMBED_BATCH_SIZE chunks; every batch is appended to `spool_path`
+    (one JSON line per chunk) as soon as it is done. Memory holds one page
+    and one batch, however long the document is. Returns the number of
+    chunks, or None if it failed.
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from pypdf import PdfReader
+
+    try:
+        _update_job(job_id, status="running", stage="parse", progress=STAGE_PROGRESS["parse"])
+        # Only the page tree is read here, for progress reporting
+        page_count = max(len(PdfReader(path).pages), 1)
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+        batch_size = settings.INGEST_EMBED_BATCH_SIZE
+        embed_share = STAGE_PROGRESS["index"] - STAGE_PROGRESS["embed"]
+
+        _update_job(job_id, stage="embed", progress=STAGE_PROGRESS["embed"])
+        # Chunks already embedded for an earlier upload are reused as-is
+        os.makedirs(settings.VECTORSTORE_DIR, exist_ok=True)
+        cache = ChunkEmbeddingCache(
+            os.path.join(settings.VECTORSTORE_DIR, "chunk_embeddings.sqlite"), settings.EMBEDDING_MODEL
+        )
+        count = 0
+        try:
+            with open(spool_path, "w") as spool:
+                pending = []
+                for pages_done, page in enumerate(PyPDFLoader(path).lazy_load(), 1):
+                    pending.extend(splitter.split_documents([page]))
+                    if len(pending) < batch_size:
+                        continue
+                    while len(pending) >= batch_size:
+                        count += _embed_batch(pending[:batch_size], cache, spool)
+                        del pending[:batch_size]
+                    done = min(pages_done / page_count, 1.0)
+                    _update_job(job_id, progress=STAGE_PROGRESS["embed"] + embed_share * done)
+                if pending:
+                    count += _embed_batch(pending, cache, spool)
+        finally:
+            cache.close()
+        return count
+    except Exception as e:
+        _update_job(job_id, status="failed", error=str(e))
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        return None
+    finally:
+        os.remove(path)
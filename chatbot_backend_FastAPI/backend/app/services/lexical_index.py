@@ -0,0 +1,88 @@
+from collections import Counter
+import json
+import math
+import os
+import re
+
+# Words, plus dotted or hyphenated runs such as "3.2.1" or "navier-stokes"
+_TOKEN = re.compile(r"\w+(?:[.\-]\w+)*")
+_PART = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased terms; compound terms are indexed whole and by their parts"""
+    terms = []
+    for match in _TOKEN.finditer(text.lower()):
+        term = match.group()
+        terms.append(term)
+        if "." in term or "-" in term:
+            terms.extend(_PART.findall(term))
+    return terms
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the chunks of one document.
+
+    Chunks are identified by their position in `ids`, which are the ids of
+    the same chunks in the Chroma collection, so lexical and dense hits can
+    be merged. Postings are kept as plain dicts and saved as JSON in the
+    document's directory.
+    """
+
+    FILENAME = "bm25.json"
+
+    def __init__(self, ids: list[str], lengths: list[int], postings: dict, k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.lengths = lengths
+        self.postings = postings  # term -> {chunk index: term frequency}
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    @classmethod
+    def build(cls, ids: list[str], texts: list[str]) -> "BM25Index":
+        index = cls([], [], {})
+        index.add(ids, texts)
+        return index
+
+    def add(self, ids: list[str], texts: list[str]):
+        """Index more chunks, so a large document can be built batch by batch"""
+        for chunk_id, text in zip(ids, texts):
+            terms = tokenize(text)
+            for term, count in Counter(terms).items():
+                self.postings.setdefault(term, {})[len(self.ids)] = count
+            self.ids.append(chunk_id)
+            self.lengths.append(len(terms))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        """Up to k (chunk id, score) pairs, best first; only chunks sharing a term"""
+        n = len(self.ids)
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for index, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / self.avg_length)
+                scores[index] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return [(self.ids[index], score) for index, score in scores.most_common(k)]
+
+    def save(self, directory: str):
+        path = os.path.join(directory, self.FILENAME)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"ids": self.ids, "lengths": self.lengths, "postings": self.postings}, f)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, directory: str):
+        path = os.path.join(directory, cls.FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        # JSON object keys are strings; chunk indexes are ints
+        postings = {term: {int(index): tf for index, tf in docs.items()} for term, docs in data["postings"].items()}
+        return cls(data["ids"], data["lengths"], postings)
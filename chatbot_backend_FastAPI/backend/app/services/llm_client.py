@@ -0,0 +1,157 @@
+from app.core.config import settings
+import asyncio
+import random
+import httpx
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """The LLM backend could not produce a response"""
+
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMClient:
+    """
+    Shared async client for the OpenAI-compatible chat completions API.
+
+    One pooled httpx.AsyncClient keeps connections to the backend alive
+    between calls. A semaphore caps in-flight requests, every call has an
+    overall deadline (for streams: until the first line, then a limit on
+    the silence between lines), and 429/5xx responses or transport errors are retried
+    with exponential backoff (honouring Retry-After when the server sends it).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        headers: dict,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        concurrency: int = 16,
+        timeout: float = 60.0,
+        stream_idle_timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.stream_idle_timeout = stream_idle_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            headers=headers,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+
+    async def complete(self, payload: dict, timeout: float | None = None) -> dict:
+        """POST payload and return the decoded JSON body"""
+        try:
+            async with asyncio.timeout(timeout or self.timeout):
+                async with self._semaphore:
+                    response = await self._send(payload, stream=False)
+                    return response.json()
+        except TimeoutError:
+            raise LLMError("LLM request timed out")
+
+    async def stream_lines(self, payload: dict, timeout: float | None = None):
+        """
+        POST payload and yield response lines as they arrive.
+
+        `timeout` covers the request and its first line; after that each
+        line must follow the previous one within stream_idle_timeout. Time
+        the caller spends between lines is not counted, so a long answer is
+        never cut off for its length. Retries only happen before the first
+        line is yielded; once the stream has started a failure is raised to
+        the caller.
+        """
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + (timeout or self.timeout)
+            try:
+                async with asyncio.timeout_at(deadline):
+                    response = await self._send(payload, stream=True)
+            except TimeoutError:
+                raise LLMError("LLM request timed out")
+            try:
+                lines = response.aiter_lines()
+                expired = "LLM request timed out"
+                while True:
+                    try:
+                        async with asyncio.timeout_at(deadline):
+                            line = await anext(lines)
+                    except StopAsyncIteration:
+                        return
+                    except TimeoutError:
+                        raise LLMError(expired)
+                    yield line
+                    expired = "LLM stream stalled"
+                    deadline = loop.time() + self.stream_idle_timeout
+            finally:
+                await response.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def _send(self, payload: dict, stream: bool) -> httpx.Response:
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                request = self._client.build_request("POST", self.url, json=payload)
+                response = await self._client.send(request, stream=stream)
+                if response.status_code == 200:
+                    return response
+                if stream:
+                    await response.aread()
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise LLMError(f"{response.status_code} - {response.text}", response.status_code)
+                retry_after = response.headers.get("Retry-After")
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise LLMError(f"Connection error: {e}")
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    def _backoff(self, attempt: int, retry_after: str | None) -> float:
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Full jitter keeps a burst of retries from hitting the backend together
+        return random.uniform(0, self.backoff_base * (2 ** attempt))
+
+
+_client = None
+
+
+def get_llm_client() -> LLMClient:
+    global _client
+    if _client is None:
+        _client = LLMClient(
+            settings.LLM_API_URL,
+            {"Authorization": f"Bearer {settings.HUGGINGFACE_TOKEN}"},
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive=settings.LLM_MAX_KEEPALIVE,
+            concurrency=settings.LLM_CONCURRENCY,
+            timeout=settings.LLM_TIMEOUT,
+            stream_idle_timeout=settings.LLM_STREAM_IDLE_TIMEOUT,
+            connect_timeout=settings.LLM_CONNECT_TIMEOUT,
+            max_retries=settings.LLM_MAX_RETRIES,
+            backoff_base=settings.LLM_BACKOFF_BASE,
+        )
+    return _client
+
+
+async def close_llm_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,250 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import asyncio
+import math
+import time
+from app.services.metrics import stage
+
+# Callers without an account are keyed by address, "ip:<host>"
+ANONYMOUS_PREFIX = "ip:"
+
+
+class LLMBusy(Exception):
+    """
+    Raised instead of calling the LLM: the user is over their rate
+    ("rate_limited", answer 429) or the queue cannot serve the call in time
+    ("queue_full", "deadline", "timeout", answer 503).
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def status_code(self) -> int:
+        return 429 if self.reason == "rate_limited" else 503
+
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        # now can predate a bucket created just after it was read
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def take(self, now: float) -> float:
+        """Take a token; returns 0, or the seconds until one is available"""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class SingleFlight:
+    """
+    One call per key at a time. Callers arriving while a call for their key
+    is in flight wait for it and get its result (or exception) instead of
+    starting their own. The call is shielded, so a caller disconnecting
+    does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.counters = {"leaders": 0, "followers": 0}
+
+    async def do(self, key: str, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.counters["leaders"] += 1
+        else:
+            self.counters["followers"] += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": len(self._calls)}
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Nobody may be left awaiting it; read the exception so it is not logged
+        if not task.cancelled():
+            task.exception()
+
+
+class LLMScheduler:
+    """
+    Admission and fair queueing for LLM calls.
+
+    admit() charges the caller's token bucket (`rate` calls per second,
+    bursts of `burst`; rate 0 turns it off) and turns the call away early
+    when the queue is already too long to serve it in time. Anonymous
+    callers get `anonymous_rate` and `anonymous_burst` instead: many people
+    can share one address behind a proxy or NAT. slot() then
+    holds one of `max_concurrency` upstream slots for the duration of the
+    call. Waiting calls are kept per user and a freed slot goes to the next
+    user in round-robin order, so one user's burst queues behind itself
+    rather than in front of everyone else.
+
+    The queue holds at most `max_queue` calls. A call whose expected wait
+    (queue length times the average slot hold time) is longer than
+    `timeout` is rejected up front, and one still waiting after `timeout`
+    gives up; both raise LLMBusy with a Retry-After estimate. Only the
+    event loop thread touches the state, so no lock is needed.
+    """
+
+    # Buckets of idle users are dropped once there are more than this many
+    MAX_BUCKETS = 10000
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 256, rate: float = 0.5, burst: int = 5, timeout: float = 15.0,
+                 anonymous_rate: float = 0.0, anonymous_burst: int = 5):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.rate = rate
+        self.burst = burst
+        self.anonymous_rate = anonymous_rate
+        self.anonymous_burst = anonymous_burst
+        self.timeout = timeout
+        self._running = 0
+        self._waiting = OrderedDict()  # user -> deque of futures, in round-robin order
+        self._queued = 0
+        self._buckets = {}
+        self._hold_seconds = None  # moving average of how long a call keeps its slot
+        self.counters = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0, "deadline": 0, "timeout": 0}
+
+    def admit(self, user: str):
+        """Charge user's bucket, or raise LLMBusy if they are over their rate or the queue is too long"""
+        if user.startswith(ANONYMOUS_PREFIX):
+            rate, burst = self.anonymous_rate, self.anonymous_burst
+        else:
+            rate, burst = self.rate, self.burst
+        if rate > 0:
+            now = time.monotonic()
+            bucket = self._buckets.get(user)
+            if bucket is None:
+                if len(self._buckets) >= self.MAX_BUCKETS:
+                    self._prune_buckets(now)
+                bucket = self._buckets[user] = TokenBucket(rate, burst)
+            wait = bucket.take(now)
+            if wait:
+                self._reject("rate_limited", wait)
+            try:
+                self._check_capacity()
+            except LLMBusy:
+                # Turned away for load, not for the user's own rate
+                bucket.give_back()
+                raise
+        else:
+            self._check_capacity()
+        self.counters["admitted"] += 1
+
+    @asynccontextmanager
+    async def slot(self, user: str):
+        """Hold an upstream slot, waiting in user's queue if all are taken"""
+        with stage("llm_queue"):
+            await self._acquire(user)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "running": self._running,
+            "waiting": self._queued,
+            "waiting_users": len(self._waiting),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+    def _expected_wait(self, position: int) -> float:
+        if self._hold_seconds is None:
+            return 0.0
+        return position * self._hold_seconds / self.max_concurrency
+
+    def _check_capacity(self):
+        if self._running < self.max_concurrency and not self._queued:
+            return
+        if self._queued >= self.max_queue:
+            self._reject("queue_full", self._expected_wait(self._queued) or 1.0)
+        wait = self._expected_wait(self._queued + 1)
+        if wait > self.timeout:
+            self._reject("deadline", wait)
+
+    def _reject(self, reason: str, retry_after: float):
+        self.counters[reason] += 1
+        raise LLMBusy(reason, retry_after)
+
+    async def _acquire(self, user: str):
+        if self._running < self.max_concurrency and not self._queued:
+            self._running += 1
+            return
+        self._check_capacity()
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user, deque()).append(future)
+        self._queued += 1
+        self.counters["queued"] += 1
+        try:
+            done, _ = await asyncio.wait((future,), timeout=self.timeout)
+        except asyncio.CancelledError:
+            if future.done():
+                # Handed a slot just as the caller went away: pass it on
+                self._release(None)
+            else:
+                self._discard(user, future)
+            raise
+        if not done:
+            self._discard(user, future)
+            self._reject("timeout", self._expected_wait(self._queued) or 1.0)
+
+    def _release(self, held: float | None):
+        if held is not None:
+            self._hold_seconds = held if self._hold_seconds is None else 0.9 * self._hold_seconds + 0.1 * held
+        # The slot moves straight to the next waiter, round-robin by user
+        while self._waiting:
+            user, queue = next(iter(self._waiting.items()))
+            future = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._waiting.move_to_end(user)
+            else:
+                del self._waiting[user]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._running -= 1
+
+    def _discard(self, user: str, future):
+        future.cancel()
+        queue = self._waiting.get(user)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self._queued -= 1
+        if not queue:
+            del self._waiting[user]
+
+    def _prune_buckets(self, now: float):
+        for user, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._buckets[user]
@@ -0,0 +1,190 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    A named family of samples, one per label combination. Counters and
+    gauges can instead be read at scrape time from `collect`, which returns
+    a number, or a dict of label-value tuples to numbers.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """(name, labels, value) triples for the text format"""
+        if self.collect is not None:
+            collected = self.collect()
+            values = collected if isinstance(collected, dict) else {(): collected}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [
+            (self.name, dict(zip(self.labelnames, key)), value)
+            for key, value in sorted(values.items())
+            if value is not None
+        ]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # label values -> [per-bucket counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        samples = []
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+http_request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds",
+    "Time until the response starts, by route template",
+    ("method", "route", "status"),
+))
+http_requests_in_progress = registry.register(Gauge(
+    "http_requests_in_progress", "Requests being handled right now",
+))
+stage_seconds = registry.register(Histogram(
+    "request_stage_duration_seconds",
+    "Time spent in each stage of a request (parent lookup, retrieval, LLM call, ...)",
+    ("stage",),
+))
+llm_tokens = registry.register(Counter(
+    "llm_tokens_total",
+    "LLM tokens sent and received; the API's usage figures when it reports them, else estimated",
+    ("direction",),
+))
+ingestion_jobs = registry.register(Counter(
+    "ingestion_jobs_total", "Finished ingestion jobs by outcome", ("status",),
+))
+
+# Stage timings of the current request, when something collects them
+_breakdown: ContextVar[dict | None] = ContextVar("stage_breakdown", default=None)
+
+
+def start_breakdown() -> dict:
+    """Collect the stage timings of the current request into the returned dict"""
+    breakdown = {}
+    _breakdown.set(breakdown)
+    return breakdown
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block into request_stage_duration_seconds and the request's breakdown"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=name)
+        breakdown = _breakdown.get()
+        if breakdown is not None:
+            breakdown[name] = breakdown.get(name, 0.0) + elapsed
+
+
+def server_timing(breakdown: dict, total: float) -> str:
+    """Stage timings as a Server-Timing header value, in milliseconds"""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in breakdown.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
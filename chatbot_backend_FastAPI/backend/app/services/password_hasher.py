@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+
+
+class PasswordHasherBusy(Exception):
+    """Raised instead of queueing when the hasher already has max_pending jobs"""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small dedicated thread pool.
+
+    bcrypt is deliberately slow, so a burst of logins would otherwise take
+    every threadpool slot (and CPU core) the rest of the app needs. At most
+    `max_workers` hashes run at once, at most `max_pending` are admitted in
+    total, and anything beyond that is rejected with PasswordHasherBusy so
+    the caller can answer 429 right away.
+    """
+
+    def __init__(self, context, max_workers: int = 2, max_pending: int = 32):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hasher")
+        self._pending = 0
+        self.counters = {"hashed": 0, "verified": 0, "rejected": 0}
+
+    async def hash(self, password: str) -> str:
+        result = await self._run(self.context.hash, password)
+        self.counters["hashed"] += 1
+        return result
+
+    async def verify_and_update(self, password: str, hashed: str) -> tuple[bool, str | None]:
+        """(valid, new_hash); new_hash is set when the stored hash uses outdated settings"""
+        result = await self._run(self.context.verify_and_update, password, hashed)
+        self.counters["verified"] += 1
+        return result
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": self._pending, "max_pending": self.max_pending, "workers": self.max_workers}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, fn, *args):
+        # Only the event loop thread touches _pending, so no lock is needed
+        if self._pending >= self.max_pending:
+            self.counters["rejected"] += 1
+            raise PasswordHasherBusy()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
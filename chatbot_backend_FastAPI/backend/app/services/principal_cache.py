@@ -0,0 +1,45 @@
+from collections import OrderedDict
+import time
+
+
+class PrincipalCache:
+    """
+    In-process TTL + LRU map from user id to the verified principal.
+
+    Entries are dropped on user updates and deletes made through the ORM in
+    this process; the TTL bounds how long any other change (another worker,
+    raw SQL) can go unnoticed.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user_id -> (expires_at, principal)
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(user_id, None)
+            self.counters["misses"] += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.counters["hits"] += 1
+        return entry[1]
+
+    def set(self, user_id, principal):
+        if self.ttl <= 0:
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl, principal)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {**self.counters, "entries": len(self._entries)}
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
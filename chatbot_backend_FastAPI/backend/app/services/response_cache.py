@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from fastapi.concurrency import run_in_threadpool
+import hashlib
+import json
+import re
+import time
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    question = re.sub(r"\s+", " ", question.lower()).strip()
+    return question.rstrip("?!. ")
+
+
+def exact_key(doc_id: str | None, question: str, context: str) -> str:
+    context_hash = hashlib.sha256(context.encode()).hexdigest()
+    raw = json.dumps([doc_id or "", normalize_question(question), context_hash])
+    return "llm-answer:" + hashlib.sha256(raw.encode()).hexdigest()
+
+
+class MemoryBackend:
+    """In-process TTL + LRU store"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: int):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def clear(self):
+        self._entries.clear()
+
+
+class RedisBackend:
+    """
+    Shared store for every worker, backed by Redis or any server speaking
+    its protocol. TTL comes from Redis expiry; configure the server with an
+    LRU maxmemory-policy for size-based eviction.
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str):
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: int):
+        await self._redis.set(key, value, ex=ttl)
+
+    async def clear(self):
+        async for key in self._redis.scan_iter("llm-answer:*"):
+            await self._redis.delete(key)
+
+
+class ResponseCache:
+    """
+    Cache of LLM answers in front of the model call.
+
+    The exact tier is keyed on (doc_id, normalized question, context hash).
+    When `embed` is given, a similarity tier also answers paraphrases of an
+    earlier question about the same document: question embeddings are kept
+    per doc_id in this process and compared by cosine similarity, and the
+    answer itself is read back from the backend under its exact key.
+    """
+
+    def __init__(self, backend, ttl: int, embed=None, similarity: float = 0.95, max_per_doc: int = 1000):
+        self.backend = backend
+        self.ttl = ttl
+        self.embed = embed
+        self.similarity = similarity
+        self.max_per_doc = max_per_doc
+        self._vectors = {}  # doc_id -> OrderedDict(key -> (expires_at, unit vector))
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0}
+
+    async def lookup(self, doc_id: str | None, question: str, context: str, semantic: bool = True):
+        """`semantic=False` skips the similarity tier, for questions that depend on more than the document"""
+        answer = await self.backend.get(exact_key(doc_id, question, context))
+        if answer is not None:
+            self.counters["exact_hits"] += 1
+            return answer
+
+        if semantic and self.embed is not None:
+            key = await self._nearest(doc_id, question)
+            if key is not None:
+                answer = await self.backend.get(key)
+                if answer is not None:
+                    self.counters["semantic_hits"] += 1
+                    return answer
+
+        self.counters["misses"] += 1
+        return None
+
+    async def store(self, doc_id: str | None, question: str, context: str, answer: str, semantic: bool = True):
+        key = exact_key(doc_id, question, context)
+        await self.backend.set(key, answer, self.ttl)
+        self.counters["stores"] += 1
+
+        if semantic and self.embed is not None:
+            vectors = self._vectors.setdefault(doc_id or "", OrderedDict())
+            vectors[key] = (time.monotonic() + self.ttl, await self._unit_vector(question))
+            while len(vectors) > self.max_per_doc:
+                vectors.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.counters["exact_hits"] + self.counters["semantic_hits"] + self.counters["misses"]
+        hits = lookups - self.counters["misses"]
+        return {**self.counters, "hit_rate": hits / lookups if lookups else 0.0}
+
+    async def _nearest(self, doc_id: str | None, question: str):
+        vectors = self._vectors.get(doc_id or "")
+        if not vectors:
+            return None
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in vectors.items() if expires_at < now]:
+            del vectors[key]
+        if not vectors:
+            return None
+
+        query = await self._unit_vector(question)
+        keys = list(vectors)
+        matrix = np.stack([vector for _, vector in vectors.values()])
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.similarity else None
+
+    async def _unit_vector(self, question: str):
+        # Embedding is CPU-bound, keep it off the event loop
+        vector = np.asarray(await run_in_threadpool(self.embed, normalize_question(question)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,100 @@
+from collections import Counter
+from fastapi.concurrency import run_in_threadpool
+import numpy as np
+
+# Reciprocal rank fusion constant; 60 is the usual choice and rarely worth tuning
+RRF_K = 60
+
+
+def _mmr(embeddings: np.ndarray, relevance: np.ndarray, k: int, lambda_mult: float) -> list[int]:
+    """Maximal marginal relevance: indexes of k candidates, trading relevance for diversity"""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.where(norms == 0, 1, norms)
+    similarity = unit @ unit.T
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(relevance)):
+        redundancy = similarity[:, selected].max(axis=1)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+async def hybrid_search(
+    vectorstore,
+    lexical,
+    question: str,
+    query_embedding: list[float],
+    k: int = 4,
+    fetch_k: int = 20,
+    mmr: bool = False,
+    mmr_lambda: float = 0.5,
+    score_threshold: float = 0.0,
+    where: dict | None = None,
+) -> list[dict]:
+    """
+    Dense and BM25 retrieval, merged by reciprocal rank fusion.
+
+    Up to `fetch_k` candidates come from each side. Dense hits whose
+    relevance (0..1, as LangChain computes it) is below `score_threshold`
+    are dropped before fusion; lexical hits only count when they share a
+    term with the question. The best `k` fused chunks are returned, or with
+    `mmr` the k that balance fused score against similarity to each other.
+    `lexical` may be None, which leaves plain dense search. `where` is a
+    Chroma metadata filter for the dense side, typically the documents the
+    lexical index covers.
+    """
+    collection = vectorstore._collection
+    relevance_fn = vectorstore._select_relevance_score_fn()
+    dense = await run_in_threadpool(
+        collection.query,
+        query_embeddings=[query_embedding],
+        n_results=fetch_k,
+        where=where,
+        include=["documents", "metadatas", "distances", "embeddings"],
+    )
+
+    chunks = {}
+    dense_ids = []
+    for i, chunk_id in enumerate(dense["ids"][0]):
+        if relevance_fn(dense["distances"][0][i]) < score_threshold:
+            continue
+        dense_ids.append(chunk_id)
+        chunks[chunk_id] = {
+            "text": dense["documents"][0][i],
+            "metadata": dense["metadatas"][0][i],
+            "embedding": dense["embeddings"][0][i],
+        }
+    lexical_ids = [chunk_id for chunk_id, _ in lexical.search(question, fetch_k)] if lexical else []
+
+    fused = Counter()
+    for ranking in (dense_ids, lexical_ids):
+        for rank, chunk_id in enumerate(ranking):
+            fused[chunk_id] += 1 / (RRF_K + rank + 1)
+    candidates = [chunk_id for chunk_id, _ in fused.most_common(fetch_k)]
+
+    # Lexical-only hits still need their text (and embedding, for MMR)
+    missing = [chunk_id for chunk_id in candidates if chunk_id not in chunks]
+    if missing:
+        stored = await run_in_threadpool(
+            collection.get, ids=missing, include=["documents", "metadatas", "embeddings"]
+        )
+        for i, chunk_id in enumerate(stored["ids"]):
+            chunks[chunk_id] = {
+                "text": stored["documents"][i],
+                "metadata": stored["metadatas"][i],
+                "embedding": stored["embeddings"][i],
+            }
+        candidates = [chunk_id for chunk_id in candidates if chunk_id in chunks]
+
+    if mmr and len(candidates) > k:
+        relevance = np.array([fused[chunk_id] for chunk_id in candidates])
+        embeddings = np.array([chunks[chunk_id]["embedding"] for chunk_id in candidates], dtype=np.float32)
+        candidates = [candidates[i] for i in _mmr(embeddings, relevance / relevance.max(), k, mmr_lambda)]
+    else:
+        candidates = candidates[:k]
+
+    return [
+        {"id": chunk_id, "text": chunks[chunk_id]["text"], "metadata": chunks[chunk_id]["metadata"], "score": fused[chunk_id]}
+        for chunk_id in candidates
+    ]
@@ -0,0 +1,272 @@
+from collections import OrderedDict
+from urllib.parse import urlparse
+import os
+import shutil
+import threading
+import uuid
+from app.services.lexical_index import BM25Index
+
+WRITE_BATCH_SIZE = 1000
+
+# Written into a document's directory by the old one-collection-per-document
+# layout, and once that collection has been copied into the library
+LEGACY_COLLECTION_FILE = "chroma.sqlite3"
+MIGRATED_MARKER = "in_library"
+
+
+class MergedLexicalIndex:
+    """BM25 search over several documents, merged by score"""
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        hits = [hit for index in self.indexes for hit in index.search(query, k)]
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)[:k]
+
+
+class PersistentVectorStore:
+    """
+    Chunks of every document in one Chroma collection, tagged with doc_id.
+
+    Searches filter on doc_id, so one ANN index answers for a single
+    document or any set of them. Each document also has a directory under
+    `root` holding a BM25 index of its chunks; the directory appears only
+    once the document is fully indexed. Recently used BM25 indexes stay in
+    an LRU bounded by `max_bytes` of on-disk size.
+
+    Chroma's embedded client only sees writes made in its own process, so
+    write() has to run in the API process, and several API processes need a
+    shared Chroma server (`url`); claim() makes a second process on an
+    embedded library fail at startup instead of serving a stale index.
+    """
+
+    COLLECTION = "library"
+    LOCK_FILE = "library.lock"
+
+    def __init__(self, root: str, max_bytes: int, embedding, url: str | None = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.embedding = embedding
+        self.url = url
+        self._library = None
+        self._hot = OrderedDict()  # doc_id -> (lexical index, size in bytes)
+        self._hot_bytes = 0
+        self._lock = threading.Lock()
+        self._migrate_lock = threading.Lock()
+        self._claim = None
+        os.makedirs(root, exist_ok=True)
+
+    def claim(self):
+        """
+        Reserve the embedded library for this process, for as long as it
+        runs. Raises RuntimeError when another process already has it, since
+        neither would see the other's writes. Does nothing with a Chroma
+        server, or where advisory locks are unavailable.
+        """
+        if self.url or self._claim is not None:
+            return
+        try:
+            import fcntl
+        except ImportError:
+            return
+        handle = open(os.path.join(self.root, self.LOCK_FILE), "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            raise RuntimeError(
+                f"Another process is using the embedded library in {self.root}; "
+                "set LIBRARY_CHROMA_URL to a Chroma server to run more than one API worker "
+                "(docker-compose.yml runs one)"
+            )
+        self._claim = handle
+
+    @property
+    def library(self):
+        """The shared collection as a LangChain Chroma store, opened on first use"""
+        with self._lock:
+            if self._library is None:
+                import chromadb
+                from langchain_community.vectorstores import Chroma
+
+                if self.url:
+                    parsed = urlparse(self.url)
+                    client = chromadb.HttpClient(
+                        host=parsed.hostname, port=parsed.port or 8000, ssl=parsed.scheme == "https"
+                    )
+                else:
+                    client = chromadb.PersistentClient(path=os.path.join(self.root, self.COLLECTION))
+                self._library = Chroma(
+                    client=client,
+                    collection_name=self.COLLECTION,
+                    embedding_function=self.embedding,
+                )
+            return self._library
+
+    def path_for(self, doc_id: str) -> str | None:
+        # doc_ids are uuids; anything else must never become a path
+        try:
+            return os.path.join(self.root, str(uuid.UUID(str(doc_id))))
+        except ValueError:
+            return None
+
+    def exists(self, doc_id: str) -> bool:
+        path = self.path_for(doc_id)
+        return path is not None and os.path.isdir(path)
+
+    def write(self, doc_id: str, texts, metadatas, embeddings):
+        """Add pre-computed embeddings for doc_id to the library"""
+        self.write_batches(doc_id, [(texts, metadatas, embeddings)])
+
+    def write_batches(self, doc_id: str, batches):
+        """
+        Add (texts, metadatas, embeddings) batches for doc_id to the library,
+        holding one batch of vectors in memory at a time.
+
+        The BM25 index is built alongside and saved after every chunk is in
+        the collection, via a staging directory renamed into place, so a
+        document never looks present while half-written.
+        """
+        path = self.path_for(doc_id)
+        if path is None:
+            raise ValueError(f"Invalid doc_id: {doc_id}")
+        collection = self.library._collection
+        # Indexing a document again replaces its chunks
+        collection.delete(where={"doc_id": doc_id})
+        lexical = BM25Index.build([], [])
+        for texts, metadatas, embeddings in batches:
+            ids = [str(uuid.uuid4()) for _ in texts]
+            self._add_to_library(doc_id, ids, texts, metadatas, embeddings)
+            lexical.add(ids, texts)
+
+        if os.path.isdir(path):
+            # Indexed before: the BM25 file is replaced atomically on its own
+            lexical.save(path)
+            self._forget(doc_id)
+            return
+        staging = f"{path}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        lexical.save(staging)
+        os.replace(staging, path)
+
+    def get(self, doc_id: str):
+        """The library if doc_id is indexed, else None; search it with search_filter()"""
+        if not self.exists(doc_id):
+            return None
+        self._migrate(doc_id)
+        return self.library
+
+    def get_lexical(self, doc_id: str):
+        """Return the BM25 index for doc_id, loading it from disk on a miss"""
+        with self._lock:
+            hit = self._hot.get(doc_id)
+            if hit:
+                self._hot.move_to_end(doc_id)
+                return hit[0]
+
+        if not self.exists(doc_id):
+            return None
+        self._migrate(doc_id)
+        path = self.path_for(doc_id)
+        lexical = BM25Index.load(path)
+        if lexical is None:
+            return None
+        return self._remember(doc_id, lexical, os.path.getsize(os.path.join(path, BM25Index.FILENAME)))
+
+    def get_lexical_many(self, doc_ids: list[str]):
+        """One index searching all of doc_ids, or None if none has one"""
+        indexes = [index for index in map(self.get_lexical, doc_ids) if index is not None]
+        if len(indexes) > 1:
+            return MergedLexicalIndex(indexes)
+        return indexes[0] if indexes else None
+
+    @staticmethod
+    def search_filter(doc_ids: list[str]) -> dict:
+        """Chroma `where` clause restricting a query to doc_ids"""
+        if len(doc_ids) == 1:
+            return {"doc_id": doc_ids[0]}
+        return {"doc_id": {"$in": list(doc_ids)}}
+
+    def delete(self, doc_id: str):
+        self._forget(doc_id)
+        path = self.path_for(doc_id)
+        if path is None:
+            return
+        self.library._collection.delete(where={"doc_id": doc_id})
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def document_count(self) -> int:
+        """Fully indexed documents: directories named by a doc_id"""
+        count = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_dir() and self.path_for(entry.name) == entry.path:
+                    count += 1
+        return count
+
+    def chunk_count(self) -> int:
+        return self.library._collection.count()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hot_lexical_indexes": len(self._hot),
+                "hot_bytes": self._hot_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _add_to_library(self, doc_id, ids, texts, metadatas, embeddings):
+        collection = self.library._collection
+        metadatas = [{**(metadata or {}), "doc_id": doc_id} for metadata in metadatas]
+        # Chroma caps the number of records per call, so write in batches
+        for start in range(0, len(texts), WRITE_BATCH_SIZE):
+            end = start + WRITE_BATCH_SIZE
+            collection.upsert(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end],
+            )
+
+    def _migrate(self, doc_id: str):
+        """Copy a document indexed in its own collection into the library, once"""
+        path = self.path_for(doc_id)
+        marker = os.path.join(path, MIGRATED_MARKER)
+        if os.path.exists(marker) or not os.path.exists(os.path.join(path, LEGACY_COLLECTION_FILE)):
+            return
+        with self._migrate_lock:
+            if os.path.exists(marker):
+                return
+            import chromadb
+
+            legacy = chromadb.PersistentClient(path=path).get_collection("doc")
+            stored = legacy.get(include=["documents", "metadatas", "embeddings"])
+            self.library._collection.delete(where={"doc_id": doc_id})
+            self._add_to_library(doc_id, stored["ids"], stored["documents"], stored["metadatas"], stored["embeddings"])
+            if BM25Index.load(path) is None:
+                BM25Index.build(stored["ids"], stored["documents"]).save(path)
+            open(marker, "w").close()
+
+    def _forget(self, doc_id):
+        with self._lock:
+            hit = self._hot.pop(doc_id, None)
+            if hit:
+                self._hot_bytes -= hit[1]
+
+    def _remember(self, doc_id, lexical, size):
+        with self._lock:
+            # Another request may have loaded it while we were reading
+            hit = self._hot.get(doc_id)
+            if hit:
+                self._hot.move_to_end(doc_id)
+                return hit[0]
+            self._hot[doc_id] = (lexical, size)
+            self._hot_bytes += size
+            # Evict least recently used, but always keep the one just added
+            while self._hot_bytes > self.max_bytes and len(self._hot) > 1:
+                _, (_, evicted_size) = self._hot.popitem(last=False)
+                self._hot_bytes -= evicted_size
+        return lexical
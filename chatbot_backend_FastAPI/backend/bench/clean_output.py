@@ -0,0 +1,96 @@
+"""
+Golden check and microbenchmark for clean_llm_output.
+
+bench/clean_output_golden.jsonl holds answers, from short plain text to
+long math-heavy ones, with the exact output of the original formatter.
+Any change to the formatter has to keep every case byte-for-byte equal:
+
+    python -m bench.clean_output --check
+
+exits with status 1 and prints the first differences otherwise. Without
+--check it also times clean_llm_output on the corpus and on answers of a
+few sizes built from it, and prints one JSON object. Run it on an older
+commit to compare.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from app.api.routes.rag_chat import clean_llm_output
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "clean_output_golden.jsonl")
+
+
+def load_golden() -> list[dict]:
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check(cases: list[dict]) -> list[int]:
+    return [i for i, case in enumerate(cases) if clean_llm_output(case["input"]) != case["expected"]]
+
+
+def _time(texts: list[str], repeat: int) -> dict:
+    per_run = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            clean_llm_output(text)
+        per_run.append(time.perf_counter() - started)
+    best = min(per_run)
+    chars = sum(len(text) for text in texts)
+    return {
+        "answers": len(texts),
+        "chars": chars,
+        "median_us_per_answer": statistics.median(per_run) / len(texts) * 1e6,
+        "best_us_per_answer": best / len(texts) * 1e6,
+        "mchars_per_second": chars / best / 1e6,
+    }
+
+
+def benchmark(cases: list[dict], repeat: int) -> dict:
+    inputs = [case["input"] for case in cases]
+    math_heavy = [text for text in inputs if text.count("\\") >= 5]
+    plain = [text for text in inputs if "\\" not in text and "$" not in text]
+    result = {"corpus": _time(inputs, repeat)}
+    if math_heavy:
+        result["math_heavy"] = _time(math_heavy, repeat)
+    if plain:
+        result["plain"] = _time(plain, repeat)
+    # One long answer per size, stitched from the corpus
+    joined = "\n\n".join(inputs)
+    for size in (1_000, 10_000, 100_000):
+        text = (joined * (size // len(joined) + 1))[:size]
+        result[f"answer_{size}_chars"] = _time([text], repeat)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="only compare against the golden outputs")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    cases = load_golden()
+    failures = check(cases)
+    for i in failures[:5]:
+        print(json.dumps({
+            "case": i,
+            "input": cases[i]["input"],
+            "expected": cases[i]["expected"],
+            "got": clean_llm_output(cases[i]["input"]),
+        }, ensure_ascii=False), file=sys.stderr)
+    if failures:
+        print(f"{len(failures)} of {len(cases)} golden cases differ", file=sys.stderr)
+        sys.exit(1)
+    if args.check:
+        print(f"all {len(cases)} golden cases match")
+        return
+
+    print(json.dumps({"golden_cases": len(cases), **benchmark(cases, args.repeat)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
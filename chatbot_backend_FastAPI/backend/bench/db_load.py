@@ -0,0 +1,114 @@
+"""
+Database-bound load test against a running backend.
+
+Registers (or logs in) a throwaway user, then keeps --concurrency clients
+busy for --duration seconds on each scenario and reports requests/sec and
+latency percentiles. Run it once against the old build and once against
+the new one to compare:
+
+    uvicorn app.main:app --port 8000
+    python -m bench.db_load --url http://localhost:8000 --duration 20 --concurrency 50
+
+Scenarios:
+    tree     GET /chat/tree
+    roots    GET /chat/roots (skipped on builds without it)
+    message  POST /chat/message, each reply nested under the previous one
+    db       GET /db-check
+
+Prints one JSON object.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+import httpx
+
+
+async def _login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    await client.post("/auth/register", json={"username": username, "password": password})
+    response = await client.post("/auth/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def _worker(client, make_request, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await make_request(client)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def _run_scenario(client, make_request, duration, concurrency) -> dict:
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        _worker(client, make_request, deadline, latencies, errors) for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - started
+    result = {"requests": len(latencies), "errors": len(errors), "requests_per_second": len(latencies) / elapsed}
+    if latencies:
+        latencies.sort()
+        result["latency_ms"] = {
+            "p50": statistics.median(latencies) * 1000,
+            "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+            "max": latencies[-1] * 1000,
+        }
+    return result
+
+
+async def main_async(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        token = await _login(client, args.username or f"bench-{uuid.uuid4().hex[:8]}", args.password)
+        client.headers["Authorization"] = f"Bearer {token}"
+
+        root = await client.post("/chat/message", json={"content": "load test root"})
+        root.raise_for_status()
+        last_id = root.json()["id"]
+
+        async def post_message(client):
+            nonlocal last_id
+            response = await client.post("/chat/message", json={"content": "load test", "parent_id": last_id})
+            if response.status_code < 400:
+                last_id = response.json()["id"]
+            return response
+
+        scenarios = {
+            "tree": lambda client: client.get("/chat/tree"),
+            "roots": lambda client: client.get("/chat/roots"),
+            "message": post_message,
+            "db": lambda client: client.get("/db-check"),
+        }
+        results = {}
+        for name in args.scenarios:
+            if name == "roots" and (await client.get("/chat/roots")).status_code == 404:
+                continue
+            results[name] = await _run_scenario(client, scenarios[name], args.duration, args.concurrency)
+        return {"url": args.url, "concurrency": args.concurrency, "duration": args.duration, "scenarios": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--scenarios", nargs="+", default=["tree", "roots", "message", "db"],
+                        choices=["tree", "roots", "message", "db"])
+    parser.add_argument("--username", default=None, help="reuse an existing user instead of a new one")
+    parser.add_argument("--password", default="bench-password")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""
+End-to-end load benchmark with local stand-ins for the LLM and the
+embedding model.
+
+Starts bench.llm_stub and a backend pointed at it, with
+EMBEDDING_MODEL=hash:<dim> so no model is downloaded or loaded. Then it
+registers a user, seeds a deep and a wide conversation tree for them
+through COPY, and drives the endpoints below: each one alone, then all of
+them together, picked at random by --mix weight. Every phase reports per
+endpoint p50/p95/p99 latency, throughput and errors, along with the
+backend's resident memory (ingestion workers included). Run from the
+backend directory against a scratch database migrated to head (seeded
+rows are left in place):
+
+    python -m bench.e2e --duration 20 --concurrency 32 --output e2e-$(git rev-parse --short HEAD).json
+    python -m bench.e2e --compare e2e-old.json e2e-new.json
+
+--url benchmarks a backend that is already running instead. Start it with
+the stand-ins (and LLM_USER_RATE=0) yourself; memory is only reported when --pid is given.
+
+Endpoints:
+    chat      POST /rag/chat continuing the deep conversation, so every turn
+              carries history
+    chat_doc  POST /rag/chat over a document uploaded before the run
+    tree      GET /chat/tree
+    subtree   GET /chat/subtree/{id}, alternating the deep and the wide tree
+    upload    POST /rag/upload-doc with a freshly generated PDF; how long
+              ingestion took to finish is reported under "ingestion"
+
+Prints one JSON object, also written to --output.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+import httpx
+from bench.db_load import _login
+
+ENDPOINTS = ["chat", "chat_doc", "tree", "subtree", "upload"]
+DEFAULT_MIX = "chat=4,chat_doc=2,tree=2,subtree=2,upload=1"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# --- Seeding ---
+
+def _tree_rows(user_id, size: int, branching: int, started: datetime.datetime):
+    """A `branching`-ary conversation tree with the app's 8-character labels"""
+    ids, paths = [], []
+    for k in range(size):
+        parent = (k - 1) // branching if k else None
+        label = uuid.uuid4().hex[:8]
+        ids.append(uuid.uuid4())
+        paths.append(f"{paths[parent]}.{label}" if parent is not None else label)
+        yield (
+            ids[-1], user_id, ids[parent] if parent is not None else None, paths[-1],
+            f"seeded message {k}", k % 2 == 0, started + datetime.timedelta(seconds=k),
+        )
+
+
+def seed_user_trees(username: str, deep: int, wide: int) -> dict:
+    """A chain of `deep` messages and a root with `wide - 1` children for username"""
+    from sqlalchemy import text
+    from app.db.session import engine
+    from bench.tree_indexes import _copy
+
+    with engine.connect() as conn:
+        user_id = conn.execute(text("SELECT id FROM users WHERE username = :u"), {"u": username}).scalar_one()
+    now = datetime.datetime.utcnow()
+    deep_rows = list(_tree_rows(user_id, deep, 1, now - datetime.timedelta(days=1)))
+    wide_rows = list(_tree_rows(user_id, wide, max(wide - 1, 1), now - datetime.timedelta(days=2)))
+    conn = engine.raw_connection()
+    try:
+        _copy(conn.cursor(), "chat_messages",
+              ["id", "user_id", "parent_id", "ltree_path", "content", "is_user", "timestamp"],
+              deep_rows + wide_rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return {
+        "deep_root": str(deep_rows[0][0]),
+        "deep_leaf": str(deep_rows[-1][0]),
+        "wide_root": str(wide_rows[0][0]),
+        "messages": len(deep_rows) + len(wide_rows),
+    }
+
+
+def make_pdf(pages: int, lines_per_page: int = 40) -> bytes:
+    """A minimal text PDF; every call has different words, so uploads never deduplicate"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>")
+    font = 3 + 2 * pages
+    for i in range(pages):
+        lines = " ".join(
+            f"(Section {i}.{j} covers topic {uuid.uuid4().hex[:6]} with worked examples) Tj T*"
+            for j in range(lines_per_page)
+        )
+        stream = f"BT /F1 10 Tf 12 TL 50 780 Td {lines} ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R"
+            f" /Resources << /Font << /F1 {font} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out, offsets = "%PDF-1.4\n", []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF"
+    return out.encode("latin-1")
+
+
+# --- Processes and memory ---
+
+def rss_bytes(pid: int) -> int | None:
+    """Resident memory of pid and all its descendants, from /proc (Linux only)"""
+    if not os.path.isdir("/proc"):
+        return None
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the ppid follows it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+        stack.extend(children.get(current, []))
+    return total
+
+
+class MemorySampler:
+    """Samples rss_bytes(pid) in the background while a phase runs"""
+
+    def __init__(self, pid: int | None, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def __aenter__(self):
+        if self.pid:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._sample()
+
+    def _sample(self):
+        value = rss_bytes(self.pid)
+        if value is not None:
+            self.samples.append(value)
+
+    async def _run(self):
+        while True:
+            self._sample()
+            await asyncio.sleep(self.interval)
+
+    def summary(self) -> dict | None:
+        if not self.samples:
+            return None
+        mb = 1024 * 1024
+        return {
+            "start_mb": self.samples[0] / mb,
+            "peak_mb": max(self.samples) / mb,
+            "end_mb": self.samples[-1] / mb,
+        }
+
+
+@contextlib.contextmanager
+def serve(app: str, port: int, env: dict, ready_path: str, timeout: float = 120.0):
+    """Run `uvicorn app` on port until the block exits; waits for ready_path to answer 200"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env},
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"{app} exited with status {process.returncode}")
+            with contextlib.suppress(httpx.HTTPError):
+                if httpx.get(f"http://127.0.0.1:{port}{ready_path}", timeout=2).status_code == 200:
+                    break
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{app} was not ready after {timeout} seconds")
+            time.sleep(0.2)
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# --- Load ---
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    # Nearest rank
+    return sorted_values[min(len(sorted_values) - 1, max(math.ceil(q * len(sorted_values)) - 1, 0))]
+
+
+def summarize(latencies: list[float], errors: Counter, elapsed: float) -> dict:
+    result = {
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if errors:
+        result["errors_by_kind"] = dict(errors)
+    if latencies:
+        latencies = sorted(latencies)
+        result["latency_ms"] = {
+            "mean": statistics.fmean(latencies) * 1000,
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": latencies[-1] * 1000,
+        }
+    return result
+
+
+async def run_phase(client, requests: dict, weights: dict, duration: float, concurrency: int, pid) -> dict:
+    """Keep `concurrency` clients busy for `duration` seconds; each request picks an endpoint by weight"""
+    names = [name for name in weights if name in requests]
+    latencies = {name: [] for name in names}
+    errors = {name: Counter() for name in names}
+    deadline = time.perf_counter() + duration
+
+    async def worker(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, [weights[n] for n in names])[0]
+            started = time.perf_counter()
+            try:
+                response = await requests[name](client)
+            except httpx.HTTPError as e:
+                errors[name][type(e).__name__] += 1
+                continue
+            if response.status_code >= 400:
+                errors[name][str(response.status_code)] += 1
+                continue
+            latencies[name].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with MemorySampler(pid) as memory:
+        await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": elapsed,
+        "endpoints": {name: summarize(latencies[name], errors[name], elapsed) for name in names},
+        "total": summarize([x for name in names for x in latencies[name]], sum(errors.values(), Counter()), elapsed),
+        "memory": memory.summary(),
+    }
+
+
+async def wait_for_jobs(client, job_ids: list[str], timeout: float) -> dict:
+    """Poll upload jobs until they finish; ingestion time is updated_at - created_at"""
+    deadline = time.monotonic() + timeout
+    pending, seconds, failed = set(job_ids), [], 0
+    while pending and time.monotonic() < deadline:
+        for job_id in list(pending):
+            job = (await client.get(f"/rag/jobs/{job_id}")).json()
+            if job.get("status") in ("done", "failed"):
+                pending.discard(job_id)
+                if job["status"] == "failed":
+                    failed += 1
+                    continue
+                took = datetime.datetime.fromisoformat(job["updated_at"]) - datetime.datetime.fromisoformat(job["created_at"])
+                seconds.append(took.total_seconds())
+        if pending:
+            await asyncio.sleep(0.5)
+    result = {"jobs": len(job_ids), "done": len(seconds), "failed": failed, "unfinished": len(pending)}
+    if seconds:
+        seconds.sort()
+        result["seconds"] = {"p50": percentile(seconds, 0.5), "p95": percentile(seconds, 0.95), "max": seconds[-1]}
+    return result
+
+
+def parse_mix(text: str) -> dict:
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}; choose from {', '.join(ENDPOINTS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+async def benchmark(args, pid) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        username = f"bench-{uuid.uuid4().hex[:8]}"
+        token = await _login(client, username, args.password)
+        client.headers["Authorization"] = f"Bearer {token}"
+        trees = await asyncio.to_thread(seed_user_trees, username, args.deep, args.wide)
+
+        upload_jobs = []
+
+        async def upload(client):
+            files = {"file": (f"bench-{uuid.uuid4().hex[:6]}.pdf", make_pdf(args.pdf_pages), "application/pdf")}
+            response = await client.post("/rag/upload-doc", files=files)
+            if response.status_code < 400:
+                upload_jobs.append(response.json()["job_id"])
+            return response
+
+        requests = {
+            "chat": lambda client: client.post("/rag/chat", data={
+                "question": f"How does step {uuid.uuid4().hex[:6]} follow?", "parent_id": trees["deep_leaf"],
+            }),
+            "tree": lambda client: client.get("/chat/tree"),
+            "subtree": lambda client: client.get(f"/chat/subtree/{random.choice([trees['deep_root'], trees['wide_root']])}"),
+            "upload": upload,
+        }
+
+        notes = []
+        if "chat_doc" in args.mix:
+            # One document, ingested before the clock starts
+            response = await upload(client)
+            ingest = await wait_for_jobs(client, upload_jobs[-1:], args.ingest_timeout) if response.status_code < 400 else {}
+            upload_jobs.clear()
+            if ingest.get("done"):
+                doc_id = response.json()["doc_id"]
+                requests["chat_doc"] = lambda client: client.post("/rag/chat", data={
+                    "question": f"What does section {random.randrange(args.pdf_pages)}.{random.randrange(40)} cover?",
+                    "doc_id": doc_id,
+                })
+            else:
+                notes.append(f"chat_doc skipped: test document did not ingest ({response.status_code}, {ingest})")
+
+        phases = {}
+        if not args.skip_isolated:
+            for name in args.mix:
+                if name in requests:
+                    phases[name] = await run_phase(client, requests, {name: 1}, args.duration, args.concurrency, pid)
+        phases["mixed"] = await run_phase(client, requests, args.mix, args.duration, args.concurrency, pid)
+        ingestion_result = await wait_for_jobs(client, upload_jobs, args.ingest_timeout) if upload_jobs else None
+
+    return {"seed": trees, "phases": phases, "ingestion": ingestion_result, "notes": notes}
+
+
+def revision() -> str | None:
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+    return None
+
+
+def compare(old: dict, new: dict) -> dict:
+    """Per phase and endpoint: new/old ratios of p95 latency and throughput, and peak memory change"""
+    result = {"old": old.get("revision"), "new": new.get("revision"), "phases": {}}
+    for phase, new_phase in new["phases"].items():
+        old_phase = old["phases"].get(phase)
+        if not old_phase:
+            continue
+        endpoints = {}
+        for name, after in new_phase["endpoints"].items():
+            before = old_phase["endpoints"].get(name)
+            if not before or "latency_ms" not in before or "latency_ms" not in after:
+                continue
+            endpoints[name] = {
+                "p95_ratio": after["latency_ms"]["p95"] / before["latency_ms"]["p95"],
+                "p99_ratio": after["latency_ms"]["p99"] / before["latency_ms"]["p99"],
+                "throughput_ratio": after["requests_per_second"] / before["requests_per_second"],
+            }
+        entry = {"endpoints": endpoints}
+        if old_phase.get("memory") and new_phase.get("memory"):
+            entry["peak_memory_mb_change"] = new_phase["memory"]["peak_mb"] - old_phase["memory"]["peak_mb"]
+        result["phases"][phase] = entry
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="benchmark this running backend instead of starting one")
+    parser.add_argument("--pid", type=int, default=None, help="backend pid for memory sampling with --url")
+    parser.add_argument("--port", type=int, default=8765, help="port for the backend started by the benchmark")
+    parser.add_argument("--llm-port", type=int, default=8766)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="stub seconds before the first token")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--llm-tokens", type=int, default=60, help="tokens per stub answer")
+    parser.add_argument("--embedding-dim", type=int, default=384)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument("--skip-isolated", action="store_true", help="only run the mixed phase")
+    parser.add_argument("--deep", type=int, default=200, help="messages in the seeded chain")
+    parser.add_argument("--wide", type=int, default=1000, help="messages in the seeded one-level tree")
+    parser.add_argument("--pdf-pages", type=int, default=5)
+    parser.add_argument("--ingest-timeout", type=float, default=120.0)
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--output", default=None, help="also write the JSON result here")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            print(json.dumps(compare(json.load(f_old), json.load(f_new)), indent=2))
+        return
+
+    config = {key: value for key, value in vars(args).items() if key not in ("password", "compare", "output")}
+    with contextlib.ExitStack() as stack:
+        pid = args.pid
+        if args.url is None:
+            stack.enter_context(serve("bench.llm_stub:app", args.llm_port, {
+                "STUB_LATENCY": str(args.llm_latency),
+                "STUB_TOKENS_PER_SEC": str(args.llm_tokens_per_sec),
+                "STUB_TOKENS": str(args.llm_tokens),
+            }, "/docs"))
+            backend = stack.enter_context(serve("app.main:app", args.port, {
+                "LLM_API_URL": f"http://127.0.0.1:{args.llm_port}/v1/chat/completions",
+                "EMBEDDING_MODEL": f"hash:{args.embedding_dim}",
+                # Every request comes from one user; measure the backend, not their rate limit
+                "LLM_USER_RATE": "0",
+            }, "/health/ready"))
+            args.url = f"http://127.0.0.1:{args.port}"
+            pid = backend.pid
+        result = asyncio.run(benchmark(args, pid))
+
+    output = {"revision": revision(), "config": config, **result}
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
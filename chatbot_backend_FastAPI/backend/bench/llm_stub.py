@@ -0,0 +1,73 @@
+"""
+Local stand-in for the OpenAI-compatible chat completions API.
+
+Point the backend at it with LLM_API_URL and run it from the backend directory:
+
+    STUB_LATENCY=0.3 STUB_TOKENS_PER_SEC=40 uvicorn bench.llm_stub:app --port 9000
+    LLM_API_URL=http://localhost:9000/v1/chat/completions uvicorn app.main:app
+
+Settings (environment variables):
+    STUB_LATENCY         seconds before the first token (default 0.2)
+    STUB_TOKENS_PER_SEC  generation speed once started (default 50)
+    STUB_TOKENS          tokens per answer (default 60)
+    STUB_FAIL_RATE       share of requests answered with 503 (default 0)
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+import os
+import random
+import time
+
+LATENCY = float(os.getenv("STUB_LATENCY", "0.2"))
+TOKENS_PER_SEC = float(os.getenv("STUB_TOKENS_PER_SEC", "50"))
+TOKENS = int(os.getenv("STUB_TOKENS", "60"))
+FAIL_RATE = float(os.getenv("STUB_FAIL_RATE", "0"))
+
+WORDS = ["the", "answer", "depends", "on", "context", "and", "question", "so", "we", "derive", "it"]
+
+app = FastAPI()
+
+
+def _tokens(seed: str):
+    rng = random.Random(seed)
+    return [rng.choice(WORDS) + " " for _ in range(TOKENS)]
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if FAIL_RATE and random.random() < FAIL_RATE:
+        return JSONResponse(status_code=503, content={"error": "stub overloaded"}, headers={"Retry-After": "0.1"})
+
+    prompt = body["messages"][-1]["content"]
+    tokens = _tokens(prompt)
+    created = int(time.time())
+
+    if not body.get("stream"):
+        await asyncio.sleep(LATENCY + len(tokens) / TOKENS_PER_SEC)
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": created,
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(tokens)},
+        }
+
+    async def events():
+        await asyncio.sleep(LATENCY)
+        for token in tokens:
+            chunk = {
+                "id": "stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get("model"),
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(1 / TOKENS_PER_SEC)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
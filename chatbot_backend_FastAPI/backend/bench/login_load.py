@@ -0,0 +1,81 @@
+"""
+Login throughput next to chat latency.
+
+Measures chat latency (GET /chat/roots, or POST /rag/chat with --chat rag)
+on its own, then again while --login-concurrency clients hammer
+/auth/token. Reports logins/sec, how many were turned away with 429, and
+how much the burst moved chat latency. Run against a running backend
+(with bench.llm_stub behind it for --chat rag):
+
+    python -m bench.login_load --url http://localhost:8000 --duration 15 --login-concurrency 64
+
+Prints one JSON object.
+"""
+import argparse
+import asyncio
+import json
+import uuid
+import httpx
+from bench.db_load import _login, _run_scenario
+
+
+async def main_async(args) -> dict:
+    limits = httpx.Limits(max_connections=args.login_concurrency + args.chat_concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        username = f"bench-{uuid.uuid4().hex[:8]}"
+        token = await _login(client, username, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        if args.chat == "rag":
+            def chat(client):
+                return client.post("/rag/chat", data={"question": f"question {uuid.uuid4().hex}"}, headers=headers)
+        else:
+            def chat(client):
+                return client.get("/chat/roots", headers=headers)
+
+        def login(client):
+            return client.post("/auth/token", data={"username": username, "password": args.password})
+
+        idle = await _run_scenario(client, chat, args.duration, args.chat_concurrency)
+
+        # Same chat load, now sharing the worker with a login burst; 429s are
+        # counted as errors by _run_scenario and reported separately below
+        rejected = 0
+
+        async def counted_login(client):
+            nonlocal rejected
+            response = await login(client)
+            if response.status_code == 429:
+                rejected += 1
+            return response
+
+        chat_result, login_result = await asyncio.gather(
+            _run_scenario(client, chat, args.duration, args.chat_concurrency),
+            _run_scenario(client, counted_login, args.duration, args.login_concurrency),
+        )
+        login_result["rejected_429"] = rejected
+
+        return {
+            "url": args.url,
+            "duration": args.duration,
+            "chat": args.chat,
+            "chat_idle": idle,
+            "chat_during_logins": chat_result,
+            "logins": login_result,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--login-concurrency", type=int, default=64)
+    parser.add_argument("--chat-concurrency", type=int, default=8)
+    parser.add_argument("--chat", choices=["roots", "rag"], default="roots")
+    parser.add_argument("--password", default="bench-password")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Startup-time benchmark.
+
+Imports app.main in fresh interpreters and, unless --skip-warm is given,
+times the embedding model warm-up that runs in the background after start.
+Run from the backend directory:
+
+    python -m bench.startup --runs 5 --max-import-seconds 2.0
+
+Prints one JSON object; exits with status 1 when the median import time is
+above --max-import-seconds, so CI can catch regressions.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import app.main
+print(time.perf_counter() - started)
+"""
+
+WARM_SNIPPET = """
+import time
+from app.api.routes.rag_chat import embedding_model
+started = time.perf_counter()
+embedding_model.warm()
+print(time.perf_counter() - started)
+"""
+
+
+def _time_snippet(snippet: str) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", snippet], check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--skip-warm", action="store_true", help="do not time the embedding model load")
+    parser.add_argument("--max-import-seconds", type=float, default=None)
+    args = parser.parse_args()
+
+    imports = [_time_snippet(IMPORT_SNIPPET) for _ in range(args.runs)]
+    result = {
+        "import_seconds": {
+            "median": statistics.median(imports),
+            "min": min(imports),
+            "max": max(imports),
+            "runs": imports,
+        }
+    }
+    if not args.skip_warm:
+        result["embedding_warm_seconds"] = _time_snippet(WARM_SNIPPET)
+
+    print(json.dumps(result, indent=2))
+    if args.max_import_seconds is not None and result["import_seconds"]["median"] > args.max_import_seconds:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Index benchmark for the per-user tree queries.
+
+Seeds chat_messages with generated conversation trees through COPY, then
+runs the queries behind /chat/tree, /chat/subtree, /chat/roots,
+/chat/children and the /rag/chat parent lookup, reporting their median
+latency and the plan Postgres chose. With --compare every query is also
+run with the tree indexes dropped (inside a transaction that is rolled
+back), so the effect of the indexes is visible in one run.
+
+Point DATABASE_URL at a scratch database migrated to head; seeding adds
+rows that are never removed. Run from the backend directory:
+
+    python -m bench.tree_indexes --messages 2000000 --users 200 --compare
+    python -m bench.tree_indexes --skip-seed --compare   # reuse seeded data
+
+Prints one JSON object.
+"""
+import argparse
+import datetime
+import io
+import json
+import random
+import statistics
+import time
+import uuid
+from sqlalchemy import text
+from app.db.session import engine
+
+TREE_INDEXES = [
+    "ix_chat_messages_user_id_ltree_path",
+    "ix_chat_messages_user_id_timestamp",
+    "ix_chat_messages_ltree_path_gist",
+    "ix_chat_messages_parent_id",
+]
+
+QUERIES = {
+    "tree_page": """
+        SELECT * FROM chat_messages
+        WHERE user_id = :user_id
+        ORDER BY ltree_path, id
+        LIMIT 1000
+    """,
+    "subtree": """
+        SELECT * FROM chat_messages
+        WHERE user_id = :user_id AND ltree_path <@ CAST(:path AS ltree)
+        ORDER BY ltree_path
+    """,
+    "roots_page": """
+        SELECT m.*, (SELECT count(*) FROM chat_messages c WHERE c.parent_id = m.id) AS child_count
+        FROM chat_messages m
+        WHERE m.user_id = :user_id AND m.parent_id IS NULL
+        ORDER BY m.timestamp DESC, m.id DESC
+        LIMIT 50
+    """,
+    "children": """
+        SELECT m.*, (SELECT count(*) FROM chat_messages c WHERE c.parent_id = m.id) AS child_count
+        FROM chat_messages m
+        WHERE m.user_id = :user_id AND m.ltree_path <@ CAST(:path AS ltree)
+          AND nlevel(m.ltree_path) = nlevel(CAST(:path AS ltree)) + 1
+        ORDER BY m.ltree_path
+    """,
+    "parent_lookup": """
+        SELECT * FROM chat_messages WHERE id = :id AND user_id = :user_id
+    """,
+}
+
+
+def _label(message_id: uuid.UUID) -> str:
+    return str(message_id).replace("-", "_")
+
+
+def _conversation_rows(user_id, size, branching, started):
+    """One conversation of `size` messages as a complete `branching`-ary tree"""
+    ids, paths = [], []
+    for k in range(size):
+        message_id = uuid.uuid4()
+        parent = (k - 1) // branching if k else None
+        path = f"{paths[parent]}.{_label(message_id)}" if parent is not None else _label(message_id)
+        ids.append(message_id)
+        paths.append(path)
+        yield (
+            message_id, user_id, ids[parent] if parent is not None else None, path,
+            f"message {k}", k % 2 == 0, started + datetime.timedelta(seconds=k),
+        )
+
+
+def _copy(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value) for value in row) + "\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def seed(messages: int, users: int, conversation_size: int, branching: int, batch: int) -> dict:
+    rng = random.Random(0)
+    started = time.perf_counter()
+    user_ids = [uuid.uuid4() for _ in range(users)]
+    now = datetime.datetime.utcnow()
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        _copy(cursor, "users", ["id", "username", "password_hash", "created_at"],
+              [(user_id, f"bench-{user_id.hex}", "!", now) for user_id in user_ids])
+
+        columns = ["id", "user_id", "parent_id", "ltree_path", "content", "is_user", "timestamp"]
+        pending, written = [], 0
+        while written + len(pending) < messages:
+            size = min(conversation_size, messages - written - len(pending))
+            started_at = now - datetime.timedelta(days=rng.randrange(365), seconds=rng.randrange(86400))
+            pending.extend(_conversation_rows(rng.choice(user_ids), size, branching, started_at))
+            if len(pending) >= batch:
+                _copy(cursor, "chat_messages", columns, pending)
+                written += len(pending)
+                pending = []
+        if pending:
+            _copy(cursor, "chat_messages", columns, pending)
+            written += len(pending)
+        cursor.execute("ANALYZE chat_messages")
+        conn.commit()
+    finally:
+        conn.close()
+    return {"users": users, "messages": written, "seconds": time.perf_counter() - started}
+
+
+def _sample_params(conn) -> dict:
+    # The busiest user, and a conversation root and mid-tree node of theirs
+    user_id = conn.execute(text(
+        "SELECT user_id FROM chat_messages GROUP BY user_id ORDER BY count(*) DESC LIMIT 1"
+    )).scalar()
+    root = conn.execute(text(
+        "SELECT id, ltree_path::text FROM chat_messages WHERE user_id = :user_id AND parent_id IS NULL LIMIT 1"
+    ), {"user_id": user_id}).one()
+    node = conn.execute(text(
+        "SELECT id, ltree_path::text FROM chat_messages WHERE user_id = :user_id AND parent_id = :root LIMIT 1"
+    ), {"user_id": user_id, "root": root.id}).one_or_none() or root
+    return {
+        "tree_page": {"user_id": user_id},
+        "subtree": {"user_id": user_id, "path": node.ltree_path},
+        "roots_page": {"user_id": user_id},
+        "children": {"user_id": user_id, "path": root.ltree_path},
+        "parent_lookup": {"user_id": user_id, "id": node.id},
+    }
+
+
+def _run_queries(conn, params: dict, repeat: int) -> dict:
+    results = {}
+    for name, sql in QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(text(sql), params[name]).all()
+            timings.append((time.perf_counter() - started) * 1000)
+        plan = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql), params[name]).scalar()
+        results[name] = {
+            "median_ms": statistics.median(timings),
+            "max_ms": max(timings),
+            "plan": _plan_summary(plan[0]["Plan"]),
+            "execution_ms": plan[0]["Execution Time"],
+        }
+    return results
+
+
+def _plan_summary(node: dict, depth: int = 0) -> list[str]:
+    """Node types and the index each one used, one line per plan node"""
+    line = "  " * depth + node["Node Type"]
+    if "Index Name" in node:
+        line += f" using {node['Index Name']}"
+    lines = [line]
+    for child in node.get("Plans", []):
+        lines.extend(_plan_summary(child, depth + 1))
+    return lines
+
+
+def benchmark(repeat: int, compare: bool) -> dict:
+    with engine.connect() as conn:
+        params = _sample_params(conn)
+        conn.rollback()
+        result = {"with_indexes": _run_queries(conn, params, repeat)}
+        conn.rollback()
+        if compare:
+            # DDL is transactional in Postgres; the rollback restores the indexes
+            for index in TREE_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+            result["without_indexes"] = _run_queries(conn, params, repeat)
+            conn.rollback()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--conversation-size", type=int, default=200, help="messages per conversation tree")
+    parser.add_argument("--branching", type=int, default=3, help="children per message")
+    parser.add_argument("--batch", type=int, default=50_000, help="rows per COPY")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per query")
+    parser.add_argument("--skip-seed", action="store_true", help="benchmark the rows already in the database")
+    parser.add_argument("--compare", action="store_true", help="also run with the tree indexes dropped")
+    args = parser.parse_args()
+
+    result = {}
+    if not args.skip_seed:
+        result["seed"] = seed(args.messages, args.users, args.conversation_size, args.branching, args.batch)
+    result["queries"] = benchmark(args.repeat, args.compare)
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()